@@ -0,0 +1,217 @@
+"""
+autotune.py
+Sweeps capture and inference settings through the real DroidVision pipeline and stores the best
+configuration per camera and board in a profile that DroidVision loads at startup.
+
+Every configuration runs in its own process for a fixed time over a camera, a recorded clip or
+videotestsrc, with follow mode on and the motors replaced by a stand-in:
+    python3 autotune.py --videosrc videotestsrc --duration 10
+    python3 autotune.py --videosrc ../recordings/walk.mp4 --top-k 10 20 --trackers none sort
+    python3 r2arc.py --profile ~/.config/r2arc/autotune.json
+"""
+
+import argparse, itertools, json, os, resource, subprocess, sys, threading, time
+
+PROFILE_PATH = os.path.join(os.path.expanduser('~'), '.config', 'r2arc', 'autotune.json')
+BOARD_MODEL = '/proc/device-tree/model'
+# Seconds of frames not measured after the first, while caches, clocks and queues settle
+WARMUP = 1.0
+# Seconds a trial waits for the pipeline to deliver frames before giving up
+STARTUP_TIMEOUT = 30.0
+
+def board_name() -> str:
+    """Returns the board model, e.g. 'Raspberry Pi 5 Model B Rev 1.0', or the machine type."""
+    try:
+        with open(BOARD_MODEL, 'r', encoding='utf-8') as f:
+            return f.read().strip('\x00\n ')
+    except OSError:
+        return os.uname().machine
+
+def camera_name(videosrc: str) -> str:
+    """Returns the name of the camera at a /dev/video path, or the source itself otherwise."""
+    if not videosrc.startswith('/dev/video'):
+        return videosrc.split()[0] if videosrc.startswith('videotestsrc') else videosrc
+    from gstreamer import cameras
+    for device in cameras.list_devices():
+        if cameras.device_path(device) == videosrc:
+            return device.get_display_name()
+    return videosrc
+
+def profile_key(videosrc) -> str:
+    """Returns the key of the profile entry for a video source (or list of them) on this board."""
+    videosrcs = [videosrc] if isinstance(videosrc, str) else list(videosrc)
+    return '{} | {}'.format(board_name(), ', '.join(camera_name(src) for src in videosrcs))
+
+def load_profile(path: str, videosrc) -> dict:
+    """Returns the tuned settings for a video source on this board, or None if there are none."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            profiles = json.load(f)
+    except (OSError, ValueError):
+        return None
+    entry = profiles.get(profile_key(videosrc))
+    return entry['settings'] if entry else None
+
+def save_profile(path: str, videosrc, best: dict, front: list) -> None:
+    """Stores the chosen configuration and the Pareto front for a video source on this board."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            profiles = json.load(f)
+    except (OSError, ValueError):
+        profiles = {}
+    profiles[profile_key(videosrc)] = {
+        'settings': best['settings'], 'measured': best['measured'],
+        'pareto': front, 'tuned': time.strftime('%Y-%m-%d %H:%M:%S')}
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(profiles, f, indent=1)
+
+def grid(resolutions, top_ks, thresholds, queue_depths, threads, trackers) -> list:
+    """Returns every combination of the settings as a list of dicts. A None resolution is the
+    capture mode DroidVision selects for the model."""
+    return [{'resolution': list(resolution) if resolution else None, 'top_k': top_k, 'threshold': threshold,
+             'queue_depth': queue_depth, 'threads': thread_count, 'tracker': tracker}
+            for resolution, top_k, threshold, queue_depth, thread_count, tracker
+            in itertools.product(resolutions, top_ks, thresholds, queue_depths, threads, trackers)]
+
+def run_trial(settings: dict, videosrc: str, videofmt: str, duration: float, model: str = None,
+              warmup: float = WARMUP) -> dict:
+    """Runs DroidVision with the settings in this process and measures it for duration seconds,
+    from warmup seconds after the first frame; pipeline start-up and warm-up are not counted.
+    Returns:
+        dict: The capture resolution, frames per second, frame latency percentiles in ms and CPU
+            cores used, or None if too few frames arrived.
+    """
+    import numpy, vision
+    from benchmark import FakeMovements
+    kwargs = {'model': model} if model else {}
+    droid = vision.DroidVision(
+        motor=FakeMovements(), videosrc=videosrc, videofmt=videofmt,
+        resolution=tuple(settings['resolution']) if settings['resolution'] else None,
+        top_k=numpy.uint8(settings['top_k']), threshold=numpy.float16(settings['threshold']),
+        tracker=settings['tracker'], queue_depth=settings['queue_depth'], threads=settings['threads'],
+        display=False, motion_gate=False, **kwargs)
+    droid.set_follow(True)
+    latencies = []
+    # Monotonic times and resource usage of the first frame, the start and the end of the measurement
+    span = {}
+    callback = droid._user_callback
+    def measured_callback(*args):
+        svg = callback(*args)
+        droid.follow = True     # Keep the follow logic in the loop
+        now = time.monotonic()
+        if 'first' not in span:
+            span['first'] = now
+        elif 'start' not in span:
+            if now - span['first'] >= warmup:
+                span['start'], span['usage'] = now, resource.getrusage(resource.RUSAGE_SELF)
+        elif 'end' not in span:
+            latencies.append(droid.frame_latency_ms)
+            span['last'] = now
+            if now - span['start'] >= duration:
+                span['end'], span['end_usage'] = now, resource.getrusage(resource.RUSAGE_SELF)
+                droid.pipeline.quit()
+        return svg
+    droid._user_callback = measured_callback
+
+    # Stops a pipeline that never delivers enough frames; files may also end earlier
+    timer = threading.Timer(STARTUP_TIMEOUT + warmup + duration, lambda: droid.pipeline and droid.pipeline.quit())
+    timer.start()
+    droid.start()
+    timer.cancel()
+    if not latencies or span['last'] <= span['start']:
+        return None
+    end_usage = span.get('end_usage') or resource.getrusage(resource.RUSAGE_SELF)
+    elapsed = span['last'] - span['start']
+    cpu = (end_usage.ru_utime - span['usage'].ru_utime) + (end_usage.ru_stime - span['usage'].ru_stime)
+    latencies = sorted(latencies)
+    percentile = lambda p: latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))]
+    return {'resolution': list(droid.resolution), 'fps': len(latencies) / elapsed,
+            'p50_ms': percentile(50), 'p95_ms': percentile(95), 'cpu': cpu / elapsed}
+
+def dominates(a: dict, b: dict) -> bool:
+    """Returns True if measurement a is at least as good as b everywhere and better somewhere."""
+    keys = (('fps', 1), ('p95_ms', -1), ('cpu', -1))
+    return (all(a[k] * sign >= b[k] * sign for k, sign in keys)
+            and any(a[k] * sign > b[k] * sign for k, sign in keys))
+
+def pareto_front(results: list) -> list:
+    """Returns the results no other result dominates."""
+    return [r for r in results if not any(dominates(o['measured'], r['measured']) for o in results if o is not r)]
+
+def choose(front: list, latency_target: float) -> dict:
+    """Returns the fastest configuration of the front within the p95 latency target, using less
+    CPU to break ties; the lowest-latency one if none meets the target."""
+    within = [r for r in front if r['measured']['p95_ms'] <= latency_target]
+    if within:
+        return max(within, key=lambda r: (round(r['measured']['fps'], 1), -r['measured']['cpu']))
+    return min(front, key=lambda r: r['measured']['p95_ms'])
+
+def sweep(configs: list, videosrc: str, videofmt: str, duration: float, model: str = None) -> list:
+    """Runs every configuration in a fresh process so they don't share the GStreamer main loop or the Edge TPU."""
+    results = []
+    for i, settings in enumerate(configs):
+        command = [sys.executable, os.path.abspath(__file__), '--trial', json.dumps(settings),
+                   '--videosrc', videosrc, '--videofmt', videofmt, '--duration', str(duration)]
+        if model:
+            command += ['--model', model]
+        try:
+            process = subprocess.run(command, capture_output=True, text=True, timeout=duration + 60,
+                                     cwd=os.path.dirname(os.path.abspath(__file__)))
+            lines = [line for line in process.stdout.splitlines() if line.startswith('RESULT ')]
+            measured = json.loads(lines[-1][len('RESULT '):]) if lines else None
+        except subprocess.TimeoutExpired:
+            measured = None
+        if measured is None:
+            print('[{}/{}] {} failed'.format(i + 1, len(configs), settings))
+            continue
+        settings = dict(settings, resolution=measured.pop('resolution'))
+        print('[{}/{}] {}: {:.1f} fps, p50 {:.1f} ms, p95 {:.1f} ms, {:.2f} CPU'.format(
+            i + 1, len(configs), settings, measured['fps'], measured['p50_ms'], measured['p95_ms'], measured['cpu']))
+        results.append({'settings': settings, 'measured': measured})
+    return results
+
+def _size(text: str) -> tuple:
+    width, height = text.lower().split('x')
+    return (int(width), int(height))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--videosrc', default='videotestsrc pattern=ball', help='Camera, clip file or videotestsrc')
+    parser.add_argument('--videofmt', default='raw', choices=['raw', 'h264', 'jpeg'])
+    parser.add_argument('--model', help='Detection model; defaults to the DroidVision model')
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds per configuration')
+    parser.add_argument('--resolutions', type=_size, nargs='+', help='Capture sizes, e.g. 864x480')
+    parser.add_argument('--top-k', type=int, nargs='+', default=[10, 20])
+    parser.add_argument('--thresholds', type=float, nargs='+', default=[0.2, 0.4])
+    parser.add_argument('--queue-depths', type=int, nargs='+', default=[1, 2])
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4], help='Video conversion threads')
+    parser.add_argument('--trackers', nargs='+', default=['none', 'sort'], choices=['none', 'sort'])
+    parser.add_argument('--latency-target', type=float, default=100.0, help='p95 frame latency target in ms')
+    parser.add_argument('--profile', default=PROFILE_PATH, help='Profile file to write')
+    parser.add_argument('--trial', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.trial:
+        result = run_trial(json.loads(args.trial), args.videosrc, args.videofmt, args.duration, args.model)
+        print('RESULT ' + json.dumps(result))
+        sys.exit(0)
+
+    resolutions = args.resolutions
+    if not resolutions:
+        # The mode DroidVision selects for the model, and on cameras the usual webcam default too
+        resolutions = [None, (640, 480)] if args.videosrc.startswith('/dev/video') else [None]
+    trackers = [None if tracker == 'none' else tracker for tracker in args.trackers]
+    configs = grid(resolutions, args.top_k, args.thresholds, args.queue_depths, args.threads, trackers)
+    print('Sweeping {} configurations of {:.0f} s on {}'.format(len(configs), args.duration, profile_key(args.videosrc)))
+    results = sweep(configs, args.videosrc, args.videofmt, args.duration, args.model)
+    if not results:
+        print('Every configuration failed')
+        sys.exit(1)
+    front = pareto_front(results)
+    best = choose(front, args.latency_target)
+    save_profile(args.profile, args.videosrc, best, front)
+    print('Pareto front: {} of {} configurations'.format(len(front), len(results)))
+    print('Best: {} ({:.1f} fps, p95 {:.1f} ms, {:.2f} CPU)'.format(
+        best['settings'], best['measured']['fps'], best['measured']['p95_ms'], best['measured']['cpu']))
+    print('Profile written to {}'.format(args.profile))
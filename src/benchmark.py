@@ -0,0 +1,246 @@
+"""
+benchmark.py
+Microbenchmarks with regression gates for the per-frame detection and decision hot paths.
+
+Drives the hot paths with synthetic interpreter outputs (0, 5, 20 and 100 detections, with and
+without tracker data) and compares the results with the baseline stored next to this file:
+    python3 benchmark.py                     # Fails if a benchmark regressed past the threshold
+    python3 benchmark.py --update-baseline   # Stores the current results as the new baseline
+    python3 benchmark.py --tracemalloc       # Fails if the steady-state frame path keeps allocating
+Timings only compare on the same board: record the baseline on the droid and commit it. Without
+a baseline, or without a baseline entry for a benchmark, the run fails unless
+--allow-missing-baseline is given (e.g. on a development machine).
+"""
+
+import argparse, json, os, sys, timeit, tracemalloc
+import numpy
+from gstreamer import cascade, common, detect
+import vision
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+DETECTION_COUNTS = (0, 5, 20, 100)
+INFERENCE_SIZE = (300, 300)
+SRC_SIZE = (864, 480)
+THRESHOLD = numpy.float16(0.2)
+
+class FakeInterpreter:
+    """Stand-in for a tflite Interpreter of an SSD model with postprocessing, with fixed outputs."""
+    def __init__(self, num_detections: int, capacity: int = 20, seed: int = 0):
+        rng = numpy.random.default_rng(seed)
+        capacity = max(capacity, num_detections)
+        xy = rng.uniform(0.0, 0.8, (capacity, 2))
+        wh = rng.uniform(0.05, 0.5, (capacity, 2))
+        boxes = numpy.concatenate((xy[:, ::-1], (xy + wh)[:, ::-1]), axis=1)   # ymin, xmin, ymax, xmax
+        classes = numpy.where(rng.random(capacity) < 0.5, 0, rng.integers(1, 90, capacity))
+        scores = numpy.where(numpy.arange(capacity) < num_detections,
+                             rng.uniform(0.3, 1.0, capacity), rng.uniform(0.0, 0.1, capacity))
+        self.top_k = capacity
+        self._tensors = {
+            0: boxes[numpy.newaxis].astype(numpy.float32),
+            1: classes[numpy.newaxis].astype(numpy.float32),
+            2: numpy.sort(scores)[::-1][numpy.newaxis].astype(numpy.float32),
+            3: numpy.array([num_detections], dtype=numpy.float32),
+            4: numpy.zeros((1, INFERENCE_SIZE[1], INFERENCE_SIZE[0], 3), dtype=numpy.uint8),
+        }
+
+    def get_input_details(self):
+        return [{'index': 4, 'shape': numpy.array(self._tensors[4].shape)}]
+
+    def get_output_details(self):
+        return [{'index': i, 'quantization': (0.0, 0)} for i in range(4)]
+
+    def tensor(self, index):
+        return lambda: self._tensors[index]
+
+    def invoke(self):
+        pass
+
+class FakeBuffer:
+    """Stand-in for a mapped Gst.Buffer holding one RGB frame."""
+    class MapInfo:
+        def __init__(self, data):
+            self.data = data
+
+    def __init__(self, size: tuple, seed: int = 0):
+        width, height = size
+        frame = numpy.random.default_rng(seed).integers(0, 255, (height, width, 3), dtype=numpy.uint8)
+        self._mapinfo = self.MapInfo(frame.tobytes())
+        self.pts = 0
+
+    def map(self, flags):
+        return True, self._mapinfo
+
+    def unmap(self, mapinfo):
+        pass
+
+class FakeMovements:
+    """Motor stand-in that accepts every command without touching SPI."""
+    def __init__(self):
+        self.last_command = None
+
+    def _send(self, command: str) -> list[int]:
+        self.last_command = ord(command)
+        return [self.last_command]
+
+    def forward(self): return self._send('W')
+    def left(self): return self._send('A')
+    def backwards(self): return self._send('S')
+    def right(self): return self._send('D')
+    def pivot_left(self): return self._send('O')
+    def pivot_right(self): return self._send('P')
+    def stop(self): return self._send('Q')
+    def send_command(self, command: str): return self._send(command)
+    def is_stopped(self) -> bool: return self.last_command in (None, ord('Q'))
+
+def tracker_data(objs: list) -> numpy.ndarray:
+    """Returns SORT-style [xmin, ymin, xmax, ymax, track_id] rows for the given objects."""
+    return numpy.array([(o.bbox.xmin, o.bbox.ymin, o.bbox.xmax, o.bbox.ymax, i + 1) for i, o in enumerate(objs)],
+                       dtype=numpy.float32).reshape(-1, 5)
+
+def benchmarks() -> dict:
+    """Returns {name: callable} for every hot path and synthetic workload."""
+    labels = {numpy.uint8(i): 'label{}'.format(i) for i in range(91)}
+    inference_box = (0, 0) + INFERENCE_SIZE
+    text_lines = ['Inference: 10.00 ms', 'FPS: 30 fps']
+    cases = {}
+
+    interpreter = FakeInterpreter(0)
+    buffer = FakeBuffer(INFERENCE_SIZE)
+    cases['common.set_input'] = lambda: common.set_input(interpreter, buffer)
+    cases['common.output_tensor'] = lambda: common.output_tensor(interpreter, 0)
+    fps_counter = common.avg_fps_counter(30)
+    cases['common.avg_fps_counter'] = lambda: next(fps_counter)
+
+    automove = vision.AutoMovements(FakeMovements())
+
+    for n in DETECTION_COUNTS:
+        interpreter = FakeInterpreter(n)
+        objs = detect.get_output(interpreter, THRESHOLD, interpreter.top_k)
+        trdata = tracker_data(objs)
+        cases['detect.get_output[{}]'.format(n)] = (
+            lambda i=interpreter: detect.get_output(i, THRESHOLD, i.top_k))
+        filtered = detect.OutputBuffers(interpreter, interpreter.top_k, detect.FOLLOW_CLASSES)
+        cases['detect.get_output[{},filtered]'.format(n)] = (
+            lambda i=interpreter, b=filtered: detect.get_output(i, THRESHOLD, i.top_k, buffers=b, nms_iou=0.7))
+        cases['detect.get_closest_obj[{}]'.format(n)] = lambda o=objs: detect.get_closest_obj(o)
+        cases['detect.get_distances[{}]'.format(n)] = lambda o=objs: detect.get_distances(o)
+        cases['detect.is_too_close[{}]'.format(n)] = lambda o=objs: [detect.is_too_close(obj) for obj in o]
+        cases['detect.generate_svg[{}]'.format(n)] = lambda o=objs: detect.generate_svg(
+            SRC_SIZE, INFERENCE_SIZE, inference_box, o, labels, text_lines, [], False)
+        cases['detect.generate_svg[{},tracker]'.format(n)] = lambda o=objs, t=trdata: detect.generate_svg(
+            SRC_SIZE, INFERENCE_SIZE, inference_box, o, labels, text_lines, t, True)
+        frame = FakeInterpreter(n).tensor(4)()[0]
+        crops = cascade.CropCascade(cascade.MeanColorInterpreter(), crop_budget=4, class_ids=range(91))
+        cases['cascade.run[{}]'.format(n)] = lambda o=objs, c=crops, f=frame: c.run(f, o)
+        cases['AutoMovements.find_human[{}]'.format(n)] = lambda o=objs: automove.find_human(o)
+    return cases
+
+def measure(func, repeat: int = 5) -> float:
+    """Returns the best time per call of func in microseconds."""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number * 1e6
+
+def run(names: list = None, repeat: int = 5) -> dict:
+    results = {}
+    for name, func in benchmarks().items():
+        if names and not any(pattern in name for pattern in names):
+            continue
+        results[name] = measure(func, repeat)
+        print('{:<45} {:>12.2f} us'.format(name, results[name]))
+    return results
+
+def frame_allocations(frames: int = 3000, num_detections: int = 20, tracker: bool = True, warmup: int = 200) -> int:
+    """Returns the net bytes still allocated after running the steady-state frame path.
+
+    The frame path mirrors DroidVision._user_callback after inference: get_output into reused
+    buffers, the tracker input view, the text lines and generate_svg.
+    """
+    interpreter = FakeInterpreter(num_detections)
+    buffers = detect.OutputBuffers(interpreter, interpreter.top_k)
+    labels = {numpy.uint8(i): 'label{}'.format(i) for i in range(91)}
+    fps_counter = common.avg_fps_counter(30)
+    inference_box = (0, 0) + INFERENCE_SIZE
+    trdata = tracker_data(detect.get_output(interpreter, THRESHOLD, interpreter.top_k, buffers=buffers))
+
+    def frame():
+        objs = detect.get_output(interpreter, THRESHOLD, interpreter.top_k, buffers=buffers)
+        detections = buffers.detections[:buffers.count]     # Tracker input
+        text_lines = [
+            'Inference: {:.2f} ms'.format(len(detections) * 0.5),
+            'FPS: {} fps'.format(round(next(fps_counter))), ]
+        return detect.generate_svg(SRC_SIZE, INFERENCE_SIZE, inference_box, objs, labels, text_lines,
+                                   trdata, tracker)
+
+    for _ in range(warmup):
+        frame()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for _ in range(frames):
+        frame()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    return sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+
+def compare(results: dict, baseline: dict, threshold: float, allow_missing: bool = False) -> list:
+    """Returns a description of every benchmark slower than its baseline by more than threshold,
+    and of every benchmark without a baseline unless allow_missing."""
+    regressions = []
+    for name, current in results.items():
+        if name not in baseline:
+            if not allow_missing:
+                regressions.append('{}: no baseline; run with --update-baseline on the target board'.format(name))
+        elif current > baseline[name] * (1 + threshold):
+            regressions.append('{}: {:.2f} us -> {:.2f} us (+{:.0%})'.format(
+                name, baseline[name], current, current / baseline[name] - 1))
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threshold', type=float, default=0.25, help='Allowed slowdown ratio before failing')
+    parser.add_argument('--baseline', default=BASELINE, help='Baseline results file')
+    parser.add_argument('--update-baseline', action='store_true', help='Store the results as the new baseline')
+    parser.add_argument('--allow-missing-baseline', action='store_true',
+                        help='Pass benchmarks that have no baseline instead of failing them')
+    parser.add_argument('--repeat', type=int, default=5, help='Timing repetitions per benchmark')
+    parser.add_argument('--tracemalloc', action='store_true', help='Check net allocation of the frame path instead')
+    parser.add_argument('--frames', type=int, default=3000, help='Frames to run with --tracemalloc')
+    parser.add_argument('--max-growth', type=int, default=64 * 1024, help='Allowed net allocation in bytes with --tracemalloc')
+    parser.add_argument('names', nargs='*', help='Only run benchmarks whose name contains one of these')
+    args = parser.parse_args()
+
+    if args.tracemalloc:
+        failed = False
+        for n in DETECTION_COUNTS:
+            for tracker in (False, True):
+                growth = frame_allocations(args.frames, n, tracker)
+                failed |= growth > args.max_growth
+                print('{:<45} {:>12} B'.format('frame path[{}{}]'.format(n, ',tracker' if tracker else ''), growth))
+        sys.exit(1 if failed else 0)
+
+    results = run(args.names, args.repeat)
+    if args.update_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, 'r', encoding='utf-8') as f:
+                baseline = json.load(f)
+        baseline.update({name: round(us, 3) for name, us in results.items()})
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, indent=4, sort_keys=True)
+        print('Baseline written to {}'.format(args.baseline))
+        sys.exit(0)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    elif args.allow_missing_baseline:
+        print('WARNING: no baseline at {}; nothing was compared'.format(args.baseline))
+    else:
+        print('ERROR: no baseline at {}; run with --update-baseline on the target board and commit it, '
+              'or pass --allow-missing-baseline'.format(args.baseline))
+        sys.exit(1)
+    regressions = compare(results, baseline, args.threshold, args.allow_missing_baseline)
+    for regression in regressions:
+        print('FAIL ' + regression)
+    sys.exit(1 if regressions else 0)
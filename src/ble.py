@@ -3,22 +3,29 @@ ble.py
 Bluetooth Low Energy (BLE) service for the R2-ARC project. Uses iOS app to send commands to the main SBC.
 '''
 
-import pybleno, array, subprocess
+import pybleno, array, subprocess, time
 
 class RecieveCharactersCharacteristic(pybleno.Characteristic):
-    """A custom characteristic for handling write requests through iOS BLE."""
+    """A custom characteristic for handling write requests through iOS BLE.
+    Write-without-response is supported for lower latency. If on_data is set, every write is
+    handed to it with its arrival time instead of being buffered for getValue().
+    """
     def __init__(self, uuid):
         super().__init__({
             'uuid': uuid,
-            'properties': ['write'],
+            'properties': ['write', 'writeWithoutResponse'],
             'value': None
         })
         self._value = array.array('B', [0]*0)  # Initialize with an empty buffer
+        self.on_data = None
 
 
     def onWriteRequest(self, data, offset, withoutResponse, callback) -> None:
-        self._value = data  # Update the value with incoming data
-        print(f'Received iOS BLE command character: {self._value.decode("utf-8")}')
+        if self.on_data:
+            self.on_data(data, time.monotonic())
+        else:
+            self._value = data  # Update the value with incoming data
+            print(f'Received iOS BLE command character: {self._value.decode("utf-8")}')
         callback(pybleno.Characteristic.RESULT_SUCCESS)
 
     def getValue(self) -> str:
@@ -29,12 +36,39 @@ class RecieveCharactersCharacteristic(pybleno.Characteristic):
     def resetValue(self) -> None:
         self._value = array.array('B', [0]*0)
 
+class TelemetryCharacteristic(pybleno.Characteristic):
+    """A notify characteristic that pushes telemetry frames to the subscribed iOS app."""
+    def __init__(self, uuid):
+        super().__init__({
+            'uuid': uuid,
+            'properties': ['notify'],
+            'value': None
+        })
+        self._update_value_callback = None
+
+    def onSubscribe(self, maxValueSize, updateValueCallback) -> None:
+        print('iOS app subscribed to telemetry')
+        self._update_value_callback = updateValueCallback
+
+    def onUnsubscribe(self) -> None:
+        print('iOS app unsubscribed from telemetry')
+        self._update_value_callback = None
+
+    def notify(self, data: bytes) -> bool:
+        """Sends data to the subscribed app. Returns False if nobody is subscribed."""
+        callback = self._update_value_callback
+        if not callback:
+            return False
+        callback(array.array('B', data))
+        return True
+
 class R2ARCService:
     """A class to handle the BLE service and characteristic."""
-    def __init__(self, service_uuid, characteristic_uuid):
+    def __init__(self, service_uuid, characteristic_uuid, telemetry_uuid=None):
         self._service_uuid = service_uuid
         self._characteristic_uuid = characteristic_uuid
         self.characteristic = RecieveCharactersCharacteristic(characteristic_uuid)
+        self.telemetry = TelemetryCharacteristic(telemetry_uuid) if telemetry_uuid else None
         self.reset_bluetooth()
         self._bleno = pybleno.Bleno()
         self.ready = False
@@ -88,7 +122,7 @@ class R2ARCService:
             self._bleno.setServices([
                 pybleno.BlenoPrimaryService({
                     'uuid': self._service_uuid,
-                    'characteristics': [self.characteristic]
+                    'characteristics': [c for c in (self.characteristic, self.telemetry) if c]
                 })
             ])
             self.ready = True
@@ -101,6 +135,10 @@ class R2ARCService:
         while not self.ready:
             pass
 
+    def notify_telemetry(self, data: bytes) -> bool:
+        """Pushes a telemetry frame to the app, if the telemetry characteristic is subscribed."""
+        return self.telemetry.notify(data) if self.telemetry else False
+
     def update_user_input(self) -> str:
         data = self.characteristic.getValue()
         self.characteristic.resetValue()
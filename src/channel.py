@@ -0,0 +1,298 @@
+'''
+channel.py
+Transport-agnostic command channel between the operator app and the main SBC for the R2-ARC project.
+Commands arrive over BLE (ble.py) or a local UDP/Unix datagram socket, in sequenced packets that can
+carry several commands at once.
+'''
+
+import collections, os, queue, socket, struct, threading, time
+
+# Packet layout: magic byte, sequence number, sender timestamp in seconds, command count,
+# followed by one ASCII byte per command. Anything not starting with the magic byte is a
+# legacy packet of plain UTF-8 command characters.
+PACKET_MAGIC = 0xA7
+PACKET_HEADER = struct.Struct('<BHdB')
+SEQ_MODULO = 1 << 16
+
+CommandPacket = collections.namedtuple('CommandPacket', ['seq', 'timestamp', 'commands', 'received'])
+
+# Telemetry frame layout (10 bytes, fits a default 20-byte BLE notification): magic byte,
+# sequence number, state, FPS, inference time in 0.1 ms, target side (-1 none, 0 left, 1 right),
+# target distance rank (255 none), last motor command byte (0 none).
+TELEMETRY_MAGIC = 0xA8
+TELEMETRY_FRAME = struct.Struct('<BHBBHbBB')
+NO_TARGET = -1
+NO_RANK = 255
+
+TelemetryFrame = collections.namedtuple('TelemetryFrame',
+    ['state', 'fps', 'inference_ms', 'target_side', 'distance_rank', 'last_command'])
+
+def encode_packet(commands: str, seq: int, timestamp: float = None) -> bytes:
+    """Encodes commands into one sequenced packet.
+    args:
+        commands (str): The command characters, e.g. 'FW'.
+        seq (int): The sequence number; wraps at 65536.
+        timestamp (float): The sender's time.monotonic(). Default is now.
+    returns:
+        bytes: The packet.
+    """
+    timestamp = time.monotonic() if timestamp is None else timestamp
+    return PACKET_HEADER.pack(PACKET_MAGIC, seq % SEQ_MODULO, timestamp, len(commands)) + commands.encode('ascii')
+
+def decode_packet(data: bytes, received: float = None) -> CommandPacket:
+    """Decodes a sequenced packet, or a legacy packet of UTF-8 command characters.
+    args:
+        data (bytes): The received bytes.
+        received (float): The time.monotonic() the bytes arrived at. Default is now.
+    returns:
+        CommandPacket: The packet; seq and timestamp are None for legacy packets.
+    """
+    received = time.monotonic() if received is None else received
+    data = bytes(data)
+    if len(data) >= PACKET_HEADER.size and data[0] == PACKET_MAGIC:
+        _, seq, timestamp, count = PACKET_HEADER.unpack_from(data)
+        commands = data[PACKET_HEADER.size:PACKET_HEADER.size + count].decode('ascii')
+        return CommandPacket(seq, timestamp, commands, received)
+    return CommandPacket(None, None, data.decode('utf-8'), received)
+
+def pack_telemetry(frame: TelemetryFrame, seq: int) -> bytes:
+    """Encodes a telemetry frame, clamping every field to its wire range."""
+    return TELEMETRY_FRAME.pack(
+        TELEMETRY_MAGIC, seq % SEQ_MODULO, frame.state & 0xFF, min(255, max(0, round(frame.fps))),
+        min(0xFFFF, max(0, round(frame.inference_ms * 10))), frame.target_side,
+        min(NO_RANK, max(0, frame.distance_rank)), frame.last_command or 0)
+
+def unpack_telemetry(data: bytes) -> tuple:
+    """Decodes a telemetry frame.
+    returns:
+        tuple: The sequence number and the TelemetryFrame.
+    """
+    _, seq, state, fps, inference, side, rank, command = TELEMETRY_FRAME.unpack(bytes(data))
+    return seq, TelemetryFrame(state, fps, inference / 10, side, rank, command)
+
+class LatencyStats:
+    """Sliding window of latencies in seconds."""
+    def __init__(self, window: int = 100):
+        self._samples = collections.deque(maxlen=window)
+
+    def record(self, latency: float) -> None:
+        self._samples.append(latency)
+
+    @property
+    def last(self) -> float:
+        return self._samples[-1] if self._samples else 0.0
+
+    def percentile(self, p: float) -> float:
+        if not self._samples:
+            return 0.0
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+    def __str__(self) -> str:
+        return 'last {:.2f} ms, p50 {:.2f} ms, p95 {:.2f} ms'.format(
+            self.last * 1000, self.percentile(50) * 1000, self.percentile(95) * 1000)
+
+class CommandChannel:
+    """Delivers command packets from a transport in order.
+    Transports call _deliver() with the raw bytes of every packet they receive; duplicate and
+    out-of-order sequenced packets are dropped. A packet with sequence number 0 restarts the
+    sequence.
+    """
+    def __init__(self):
+        self._packets = queue.Queue()
+        self._last_seq = None
+        self.dropped = 0
+
+    def _deliver(self, data: bytes, received: float = None) -> None:
+        try:
+            packet = decode_packet(data, received)
+        except (UnicodeDecodeError, struct.error) as e:
+            print(f"Dropping malformed command packet: {e}")
+            self.dropped += 1
+            return
+        if packet.seq is not None:
+            # Sequence 0 starts a new session, e.g. after the app reconnected
+            if self._last_seq is not None and packet.seq != 0:
+                ahead = (packet.seq - self._last_seq) % SEQ_MODULO
+                if ahead == 0 or ahead >= SEQ_MODULO // 2:
+                    self.dropped += 1
+                    return
+            self._last_seq = packet.seq
+        self._packets.put(packet)
+
+    def setup(self) -> None:
+        """Starts the transport."""
+
+    def stop(self) -> None:
+        """Stops the transport."""
+
+    def publish(self, data: bytes) -> None:
+        """Sends an outbound frame to the operator, if the transport has one connected."""
+
+    def receive(self, timeout: float = None) -> CommandPacket:
+        """Blocks until the next packet arrives.
+        args:
+            timeout (float): Seconds to wait. Default waits forever.
+        returns:
+            CommandPacket: The packet, or None on timeout.
+        """
+        try:
+            return self._packets.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+class BLECommandChannel(CommandChannel):
+    """Command channel over the R2-ARC BLE service (write and write-without-response), with
+    telemetry sent as notifications of a second characteristic."""
+    def __init__(self, service_uuid: str, characteristic_uuid: str, telemetry_uuid: str = None):
+        super().__init__()
+        import ble     # pybleno is only needed for this transport
+        self.service = ble.R2ARCService(service_uuid, characteristic_uuid, telemetry_uuid)
+        self.service.characteristic.on_data = self._deliver
+
+    def publish(self, data: bytes) -> None:
+        self.service.notify_telemetry(data)
+
+    def setup(self) -> None:
+        self.service.setup()
+
+    def stop(self) -> None:
+        self.service.stop()
+
+class SocketCommandChannel(CommandChannel):
+    """Command channel over a UDP socket, or a Unix datagram socket if address is a path."""
+    def __init__(self, address=('0.0.0.0', 5005)):
+        super().__init__()
+        self.address = address
+        self.running = False
+        self._unix = isinstance(address, str)
+        self._socket = None
+        self._thread = None
+        self._peer = None     # Telemetry goes to whoever sent the last command
+
+    def setup(self) -> None:
+        if self._unix:
+            if os.path.exists(self.address):
+                os.unlink(self.address)
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        else:
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind(self.address)
+        self._socket.settimeout(0.5)
+        if not self._unix:
+            self.address = self._socket.getsockname()
+        self.running = True
+        self._thread = threading.Thread(target=self._receive_loop, daemon=True)
+        self._thread.start()
+
+    def _receive_loop(self) -> None:
+        while self.running:
+            try:
+                data, peer = self._socket.recvfrom(512)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            self._deliver(data, time.monotonic())
+            if peer:
+                self._peer = peer
+
+    def publish(self, data: bytes) -> None:
+        if self._peer:
+            try:
+                self._socket.sendto(data, self._peer)
+            except OSError:
+                self._peer = None
+
+    def stop(self) -> None:
+        self.running = False
+        if self._thread:
+            self._thread.join()
+        if self._socket:
+            self._socket.close()
+        if self._unix and os.path.exists(self.address):
+            os.unlink(self.address)
+
+class TelemetryPublisher:
+    """Samples telemetry on its own thread and publishes it rate-limited.
+
+    At most rate_hz frames per second are sent, and only when the frame changed since the last
+    one sent or heartbeat seconds passed, so an idle droid does not flood the radio. The sample
+    function only reads state, so the control loop never waits on the transport.
+    """
+    def __init__(self, channel: CommandChannel, sample, rate_hz: float = 5.0, heartbeat: float = 2.0):
+        self.channel = channel
+        self.sample = sample
+        self.period = 1.0 / rate_hz
+        self.heartbeat = heartbeat
+        self.running = False
+        self.sent = 0
+        self._thread = None
+
+    def start(self) -> None:
+        self.running = True
+        self._thread = threading.Thread(target=self._publish_loop, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self.running = False
+        if self._thread:
+            self._thread.join()
+
+    def _publish_loop(self) -> None:
+        last_frame, last_sent = None, 0.0
+        next_time = time.monotonic()
+        while self.running:
+            now = time.monotonic()
+            frame = self.sample()
+            # Compare the wire encoding so changes below its resolution don't count
+            encoded = pack_telemetry(frame, 0)
+            if encoded != last_frame or now - last_sent >= self.heartbeat:
+                self.channel.publish(pack_telemetry(frame, self.sent))
+                self.sent += 1
+                last_frame, last_sent = encoded, now
+            next_time += self.period
+            time.sleep(max(0.0, next_time - time.monotonic()))
+
+class CommandSender:
+    """Sends sequenced command packets to a SocketCommandChannel; a stand-in for the iOS app."""
+    def __init__(self, address=('127.0.0.1', 5005)):
+        self.address = address
+        family = socket.AF_UNIX if isinstance(address, str) else socket.AF_INET
+        self._socket = socket.socket(family, socket.SOCK_DGRAM)
+        self.seq = 0
+
+    def send(self, commands: str) -> None:
+        self._socket.sendto(encode_packet(commands, self.seq), self.address)
+        self.seq = (self.seq + 1) % SEQ_MODULO
+
+    def receive_telemetry(self, timeout: float = 1.0) -> tuple:
+        """Returns the next (seq, TelemetryFrame) sent back by the channel, or None on timeout."""
+        self._socket.settimeout(timeout)
+        try:
+            return unpack_telemetry(self._socket.recv(64))
+        except socket.timeout:
+            return None
+
+    def close(self) -> None:
+        self._socket.close()
+
+if __name__ == '__main__':
+    # Test the channel over local UDP: send packets to ourselves and print what arrives
+    channel = SocketCommandChannel(('127.0.0.1', 0))
+    channel.setup()
+    sender = CommandSender(channel.address)
+    transit = LatencyStats()
+    for commands in ('F', 'WA', 'Q', 'RWWD', 'Q'):
+        sender.send(commands)
+        packet = channel.receive(timeout=1.0)
+        transit.record(packet.received - packet.timestamp)
+        print(f"Seq {packet.seq}: {packet.commands}")
+    print(f"Transit latency: {transit}")
+    publisher = TelemetryPublisher(channel, lambda: TelemetryFrame(1, 29.6, 12.34, 0, 7, ord('W')), rate_hz=20)
+    publisher.start()
+    print(f"Telemetry: {sender.receive_telemetry()}")
+    publisher.stop()
+    sender.close()
+    channel.stop()
@@ -0,0 +1,132 @@
+'''
+control.py
+Fixed-rate control loop for the R2-ARC project: runs the follow logic at a steady rate on the
+latest detections, instead of whenever the camera and the Edge TPU deliver a frame.
+'''
+
+import collections, threading, time
+
+# The latest detections of one camera, as published by DroidVision for the control loop.
+# frame counts the camera's frames, so the loop can tell a new frame from one it decided on.
+Snapshot = collections.namedtuple('Snapshot', ['objs', 'captured', 'trdata', 'mot_tracker', 'frame'])
+
+# Detections older than this many seconds are not steered by; the vision pipeline stalled
+MAX_SNAPSHOT_AGE = 0.5
+
+class ControlLoop:
+    """Calls step(now) rate times a second on a monotonic clock.
+
+    Deadlines are start + n / rate, so scheduling does not drift however long each step or
+    sleep takes. A step that runs past the next deadline is an overrun; the deadlines it ran
+    past are skipped rather than run back to back. The lateness of every wake-up (jitter) is
+    kept for the last window ticks.
+    """
+    def __init__(self, step, rate: float = 50.0, window: int = 500, clock=time.monotonic, sleep=time.sleep):
+        """
+        Args:
+            step (callable): Called with the deadline time every period.
+            rate (float, optional): Steps per second. Defaults to 50.
+            window (int, optional): Ticks the jitter statistics cover. Defaults to 500.
+            clock (callable, optional): The time source. Defaults to time.monotonic.
+            sleep (callable, optional): Sleeps for a number of seconds. Defaults to time.sleep.
+        """
+        self.step = step
+        self.period = 1.0 / rate
+        self._clock = clock
+        self._sleep = sleep
+        self.ticks = 0
+        self.overruns = 0   # Steps that ran past the next deadline
+        self.skipped = 0    # Deadlines skipped after overruns
+        self.jitter = collections.deque(maxlen=window)  # Seconds each wake-up was late
+        self.busy = collections.deque(maxlen=window)    # Seconds each step took
+        self.running = False
+        self._thread = None
+
+    def run(self, ticks: int = None) -> None:
+        """Runs the loop in this thread until stop(), or for a number of ticks."""
+        self.running = True
+        start = self._clock()
+        n = 0
+        while self.running and (ticks is None or self.ticks < ticks):
+            deadline = start + n * self.period
+            now = self._clock()
+            if now < deadline:
+                self._sleep(deadline - now)
+                now = self._clock()
+            self.jitter.append(now - deadline)
+            self.step(deadline)
+            done = self._clock()
+            self.busy.append(done - now)
+            self.ticks += 1
+            n += 1
+            if done > start + n * self.period:
+                # Ran past the next deadline: resume at the first deadline still ahead
+                self.overruns += 1
+                late = int((done - start) / self.period) + 1 - n
+                self.skipped += late
+                n += late
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self.running = False
+        if self._thread:
+            self._thread.join()
+
+    def stats(self) -> dict:
+        """Returns the tick counts and the jitter and step time in ms over the window."""
+        jitter = sorted(self.jitter) or [0.0]
+        busy = list(self.busy) or [0.0]
+        return {
+            'ticks': self.ticks, 'overruns': self.overruns, 'skipped': self.skipped,
+            'jitter_mean_ms': sum(jitter) / len(jitter) * 1000,
+            'jitter_p99_ms': jitter[min(len(jitter) - 1, int(0.99 * len(jitter)))] * 1000,
+            'jitter_max_ms': jitter[-1] * 1000,
+            'busy_mean_ms': sum(busy) / len(busy) * 1000,
+        }
+
+class FakeClock:
+    """Stand-in for time.monotonic and time.sleep that only advances when slept or told to."""
+    def __init__(self, start: float = 0.0):
+        self.time = start
+
+    def __call__(self) -> float:
+        return self.time
+
+    def sleep(self, seconds: float) -> None:
+        self.time += max(seconds, 0.0)
+
+    def advance(self, seconds: float) -> None:
+        self.time += seconds
+
+if __name__ == '__main__':
+    # Drive a fake motor at 50 Hz on a fake clock while every fifth step takes 15 ms and every
+    # hundredth 50 ms, and compare with commands sent on the arrival of 15 fps frames with up
+    # to 20 ms of jitter and one frame in ten dropped.
+    import random
+    clock = FakeClock()
+    sent = []
+
+    def step(deadline: float):
+        sent.append(clock())
+        if len(sent) % 100 == 0:
+            clock.advance(0.050)    # E.g. a garbage collection pause
+        elif len(sent) % 5 == 0:
+            clock.advance(0.015)    # A slow decision
+        else:
+            clock.advance(0.002)
+
+    loop = ControlLoop(step, rate=50.0, clock=clock, sleep=clock.sleep)
+    loop.run(ticks=500)
+    gaps = [b - a for a, b in zip(sent, sent[1:])]
+    print('Control loop:  {} commands in {:.1f} s, gap {:.1f}..{:.1f} ms, stats {}'.format(
+        len(sent), clock() - sent[0], min(gaps) * 1000, max(gaps) * 1000,
+        {key: round(value, 2) for key, value in loop.stats().items()}))
+
+    random.seed(0)
+    arrivals = sorted(i / 15 + random.uniform(0.0, 0.020) for i in range(150) if random.random() > 0.1)
+    gaps = [b - a for a, b in zip(arrivals, arrivals[1:])]
+    print('Frame arrival: {} commands in {:.1f} s, gap {:.1f}..{:.1f} ms'.format(
+        len(arrivals), arrivals[-1] - arrivals[0], min(gaps) * 1000, max(gaps) * 1000))
@@ -0,0 +1,258 @@
+'''
+governor.py
+Thermal and load-aware performance governor for the R2-ARC project.
+
+Samples the CPU temperature, clock cap and firmware throttle flags, the Edge TPU temperature
+and the measured frame latency, and steps DroidVision through fixed performance levels before the hardware throttles
+itself: capture frame rate, detection interval, overlay and top_k are turned down as far as the
+worst reading asks, and back up a level at a time once the readings stayed clear for a cool-down.
+'''
+
+import collections, glob, os, threading, time
+
+PerformanceLevel = collections.namedtuple('PerformanceLevel',
+    ['name', 'framerate', 'detect_interval', 'overlay', 'top_k'])
+
+# From full performance to the lowest level the follow logic still works at, relative to the
+# settings DroidVision started with (e.g. from an autotune profile): framerate caps the capture
+# rate (None: no cap), detect_interval multiplies the detection interval, overlay False turns
+# the overlay off, and top_k is the fraction of top_k kept.
+LEVELS = (
+    PerformanceLevel('full', None, 1, True, 1.0),
+    PerformanceLevel('warm', 20, 1, True, 0.5),
+    PerformanceLevel('hot', 15, 2, False, 0.5),
+    PerformanceLevel('critical', 10, 3, False, 0.25),
+)
+
+# Readings at or above the n-th threshold ask for at least level n (1-based); higher is worse
+# for every reading. cpu_throttle is how far the cpufreq policy caps the CPU clock below its
+# maximum (0 to 1); the current clock is not used, as cpufreq lowers it whenever the load is
+# light. firmware_throttle is the throttle_severity of the Raspberry Pi firmware flags.
+THRESHOLDS = {
+    'cpu_temp': (70.0, 75.0, 80.0),         # degrees C; the Pi 5 throttles at 85
+    'tpu_temp': (80.0, 85.0, 90.0),         # degrees C; the Edge TPU driver throttles at 85
+    'cpu_throttle': (0.05, 0.2, 0.4),
+    'firmware_throttle': (1, 2, 3),
+    'frame_latency': (80.0, 120.0, 200.0),  # ms from capture to decision
+}
+# How far below a threshold a reading has to be before it stops counting, so levels don't flap
+HYSTERESIS = {'cpu_temp': 3.0, 'tpu_temp': 3.0, 'cpu_throttle': 0.03, 'firmware_throttle': 0.5,
+              'frame_latency': 20.0}
+
+CPU_TEMP = 'sys/class/thermal/thermal_zone0/temp'
+CPU_POLICY_MAX_FREQ = 'sys/devices/system/cpu/cpu0/cpufreq/scaling_max_freq'
+CPU_MAX_FREQ = 'sys/devices/system/cpu/cpu0/cpufreq/cpuinfo_max_freq'
+TPU_TEMP = 'sys/class/apex/apex_0/temp'     # PCIe Coral; a USB Coral has no sensor
+# Hex flags of the Raspberry Pi firmware; the soc node is named soc@107c000000 on the Pi 5
+FIRMWARE_THROTTLED = 'sys/devices/platform/soc*/soc*:firmware/get_throttled'
+
+# get_throttled bits set while the condition lasts; bits 16-19 only latch that it happened
+UNDER_VOLTAGE, FREQ_CAPPED, THROTTLED, SOFT_TEMP_LIMIT = 0x1, 0x2, 0x4, 0x8
+
+def _read(path: str, scale: float = 1.0, base: int = 10) -> float:
+    """Returns the number in a sysfs file divided by scale, or None if it can't be read."""
+    try:
+        with open(path, 'r', encoding='ascii') as f:
+            return int(f.read().strip(), base) / scale
+    except (OSError, ValueError):
+        return None
+
+def throttle_severity(flags: int) -> int:
+    """Returns how bad the current get_throttled flags are: 0 none, 1 under-voltage, 2 clock
+    capped or soft temperature limit, 3 throttled; None if there are no flags."""
+    if flags is None:
+        return None
+    if flags & THROTTLED:
+        return 3
+    if flags & (FREQ_CAPPED | SOFT_TEMP_LIMIT):
+        return 2
+    return 1 if flags & UNDER_VOLTAGE else 0
+
+def pressure(readings: dict, thresholds: dict = THRESHOLDS, margin: dict = None) -> tuple:
+    """Returns the level the readings ask for and the reading that asks for it.
+    Args:
+        readings (dict): The sampled readings; None values are ignored.
+        thresholds (dict, optional): Defaults to THRESHOLDS.
+        margin (dict, optional): Lowers every threshold by this much. Defaults to no margin.
+    Returns:
+        tuple: The level index and the name of the deciding reading, or (0, None).
+    """
+    level, reason = 0, None
+    for name, value in readings.items():
+        if value is None or name not in thresholds:
+            continue
+        lowered = (margin or {}).get(name, 0.0)
+        asked = sum(value >= threshold - lowered for threshold in thresholds[name])
+        if asked > level:
+            level, reason = asked, name
+    return level, reason
+
+def resolve_levels(base: PerformanceLevel, levels: tuple = LEVELS) -> tuple:
+    """Returns the levels as absolute settings, applied to the base settings; level 0 is base."""
+    resolved = []
+    for level in levels:
+        caps = [rate for rate in (base.framerate, level.framerate) if rate is not None]
+        resolved.append(PerformanceLevel(
+            level.name, min(caps) if caps else None, base.detect_interval * level.detect_interval,
+            base.overlay and level.overlay, max(1, int(round(base.top_k * level.top_k)))))
+    return tuple(resolved)
+
+class PerformanceGovernor:
+    """Adjusts the performance knobs of a DroidVision from a sampling thread.
+
+    The levels are relative to the knob settings of the vision pipeline when the governor is
+    created, so full performance restores those rather than fixed defaults. Degrading is
+    immediate, straight to the level the worst reading asks for. Recovering goes up one level at
+    a time, each after every reading stayed below its threshold minus its hysteresis for
+    cooldown seconds.
+    """
+    def __init__(self, vision, sysfs_root: str = '/', interval: float = 1.0, cooldown: float = 10.0,
+                 levels: tuple = LEVELS, thresholds: dict = THRESHOLDS, hysteresis: dict = HYSTERESIS,
+                 clock=time.monotonic):
+        """
+        Args:
+            vision (DroidVision): The vision pipeline to govern.
+            sysfs_root (str, optional): The directory sysfs paths are relative to; a fake tree for tests. Defaults to '/'.
+            interval (float, optional): Seconds between samples. Defaults to 1.0.
+            cooldown (float, optional): Seconds of clear readings before stepping up a level. Defaults to 10.0.
+            levels (tuple, optional): The relative PerformanceLevels, from full performance down. Defaults to LEVELS.
+            thresholds (dict, optional): Defaults to THRESHOLDS.
+            hysteresis (dict, optional): Defaults to HYSTERESIS.
+            clock (callable, optional): The time source. Defaults to time.monotonic.
+        """
+        self.vision = vision
+        self.sysfs_root = sysfs_root
+        self.interval = interval
+        self.cooldown = cooldown
+        base = PerformanceLevel('full', vision.capture_framerate, vision.detect_interval, vision.overlay,
+                                int(vision.top_k))
+        self.levels = resolve_levels(base, levels)
+        self.thresholds = thresholds
+        self.hysteresis = hysteresis
+        self._clock = clock
+        self.level = 0
+        self.readings = {}
+        self.transitions = 0
+        self._clear_since = None
+        self.running = False
+        self._thread = None
+
+    def _path(self, path: str) -> str:
+        return os.path.join(self.sysfs_root, path)
+
+    def sample(self) -> dict:
+        """Returns the current readings; a reading is None if its source is missing."""
+        policy_max_freq = _read(self._path(CPU_POLICY_MAX_FREQ))
+        cpu_max_freq = _read(self._path(CPU_MAX_FREQ))
+        throttle = 1.0 - policy_max_freq / cpu_max_freq if policy_max_freq and cpu_max_freq else None
+        flags = [_read(path, base=16) for path in sorted(glob.glob(self._path(FIRMWARE_THROTTLED)))]
+        return {
+            'cpu_temp': _read(self._path(CPU_TEMP), 1000),
+            'tpu_temp': _read(self._path(TPU_TEMP), 1000),
+            'cpu_throttle': throttle,
+            'firmware_throttle': throttle_severity(int(flags[0]) if flags and flags[0] is not None else None),
+            'frame_latency': getattr(self.vision, 'frame_latency_ms', None) or None,
+        }
+
+    def apply(self, level: int) -> None:
+        """Sets the knobs of the vision pipeline to a level."""
+        settings = self.levels[level]
+        self.vision.set_capture_framerate(settings.framerate)
+        self.vision.detect_interval = settings.detect_interval
+        self.vision.set_overlay(settings.overlay)
+        self.vision.set_top_k(settings.top_k)
+
+    def _transition(self, level: int, reason: str) -> None:
+        old, new = self.levels[self.level], self.levels[level]
+        self.level = level
+        self.transitions += 1
+        self.apply(level)
+        readings = ', '.join('{} {:.2f}'.format(name, value) for name, value in self.readings.items() if value is not None)
+        print(f"Governor: {old.name} -> {new.name} ({reason}; {readings})")
+
+    def step(self) -> PerformanceLevel:
+        """Samples once and changes level if the readings ask for it.
+        Returns:
+            PerformanceLevel: The level in effect.
+        """
+        now = self._clock()
+        self.readings = self.sample()
+        wanted, reason = pressure(self.readings, self.thresholds)
+        wanted = min(wanted, len(self.levels) - 1)
+        if wanted > self.level:
+            self._clear_since = None
+            self._transition(wanted, reason + ' high')
+            return self.levels[self.level]
+        cooled, _ = pressure(self.readings, self.thresholds, self.hysteresis)
+        if self.level == 0 or cooled >= self.level:
+            self._clear_since = None
+        elif self._clear_since is None:
+            self._clear_since = now
+        elif now - self._clear_since >= self.cooldown:
+            self._clear_since = now
+            self._transition(self.level - 1, 'cooled down')
+        return self.levels[self.level]
+
+    def start(self) -> None:
+        self.running = True
+        self._thread = threading.Thread(target=self._governor_loop, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self.running = False
+        if self._thread:
+            self._thread.join()
+
+    def _governor_loop(self) -> None:
+        next_time = time.monotonic()
+        while self.running:
+            self.step()
+            next_time += self.interval
+            time.sleep(max(0.0, next_time - time.monotonic()))
+
+if __name__ == '__main__':
+    # Heat a fake sysfs tree up and cool it down again, printing every transition
+    import tempfile
+
+    class FakeVision:
+        """Stand-in for DroidVision that only keeps the knob settings."""
+        frame_latency_ms = 40.0
+        capture_framerate, detect_interval, overlay, top_k = None, 1, True, 12   # e.g. from a profile
+        def set_capture_framerate(self, framerate): self.framerate = framerate
+        def set_overlay(self, overlay): self.overlay = overlay
+        def set_top_k(self, top_k): self.top_k = top_k
+
+    with tempfile.TemporaryDirectory() as root:
+        def write(path, value):
+            os.makedirs(os.path.dirname(os.path.join(root, path)), exist_ok=True)
+            with open(os.path.join(root, path), 'w', encoding='ascii') as f:
+                f.write('{}\n'.format(int(value)))
+
+        def write_flags(flags):
+            path = os.path.join(root, FIRMWARE_THROTTLED.replace('*', '@107c000000'))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w', encoding='ascii') as f:
+                f.write('{:x}\n'.format(flags))
+
+        t = [0.0]
+        governor = PerformanceGovernor(FakeVision(), sysfs_root=root, clock=lambda: t[0])
+        write(CPU_MAX_FREQ, 2400000)
+        write(CPU_POLICY_MAX_FREQ, 2400000)
+        write(CPU_TEMP, 50000)
+        write_flags(0)
+        # Lightly loaded and cool: cpufreq runs the clock at 1.5 of 2.4 GHz, which is no reason to degrade
+        write('sys/devices/system/cpu/cpu0/cpufreq/scaling_cur_freq', 1500000)
+        for i in range(5):
+            t[0] = float(i - 5)
+            governor.step()
+        print(f"Idle at a low clock: {governor.levels[governor.level].name}")
+        temps = [60 + i for i in range(25)] + [84 - i for i in range(30)] + [55] * 40
+        for i, temp in enumerate(temps):
+            t[0] = float(i)
+            write(CPU_TEMP, temp * 1000)
+            write(CPU_POLICY_MAX_FREQ, 2400000 if temp < 82 else 1800000)
+            write_flags(SOFT_TEMP_LIMIT | FREQ_CAPPED if temp >= 80 else 0)
+            governor.step()
+        print(f"{governor.transitions} transitions, ended at {governor.levels[governor.level].name}, "
+              f"top_k {governor.vision.top_k}")
+        print(f"Levels: {[(level.name, level.framerate, level.detect_interval, level.top_k) for level in governor.levels]}")
@@ -4,4 +4,4 @@ __init__.py: The gstreamer package.
 
 from .detect import Object
 
-__all__ = ["cameras", "common", "detect", "gstreamer", "tracker"]
+__all__ = ["cameras", "cascade", "common", "detect", "gstreamer", "ranging", "recorder", "streaming", "tracker"]
@@ -1,16 +1,264 @@
-import cv2
+"""
+cameras.py
+Camera capability probing through GStreamer's DeviceMonitor, with an on-disk cache keyed by
+device identity, and selection of the capture mode that is cheapest to turn into model input.
+"""
 
-def get_resolution(camera_id: int = 0) -> tuple:
+import collections
+import json
+import os
+import re
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'r2arc', 'cameras.json')
+
+# Relative CPU cost per pixel of turning a frame of this format into RGB model input.
+CONVERSION_COST = {
+    'RGB': 0.0,
+    'BGR': 0.3, 'RGBx': 0.3, 'BGRx': 0.3, 'xRGB': 0.3, 'RGBA': 0.3, 'BGRA': 0.3,
+    'YUY2': 1.0, 'UYVY': 1.0, 'NV12': 1.0, 'NV21': 1.0, 'I420': 1.0, 'YV12': 1.0,
+    'JPEG': 3.0,
+    'H264': 4.0,
+}
+DEFAULT_CONVERSION_COST = 1.5
+
+# Capture size of sources that are not cameras (videotestsrc, clips, streams), which are scaled to it
+DEFAULT_RESOLUTION = (640, 480)
+
+class CameraMode(collections.namedtuple('CameraMode', ['format', 'width', 'height', 'framerates'])):
+    """One capture mode of a camera.
+    width and height are None if the source can produce any size (e.g. videotestsrc), and an
+    empty framerates tuple means any frame rate.
+    """
+    __slots__ = ()
+
+    @property
+    def videofmt(self) -> str:
+        """Returns the run_pipeline videofmt for this mode: 'raw', 'jpeg' or 'h264'."""
+        return {'JPEG': 'jpeg', 'H264': 'h264'}.get(self.format, 'raw')
+
+    @property
+    def max_framerate(self) -> float:
+        return max(self.framerates) if self.framerates else float('inf')
+
+def _field(text: str, name: str):
+    """Returns the values of a caps field as a list, ('range', lo, hi) for ranges, or None."""
+    match = re.search(r'(?:^|[ ,])%s=\(\w+\)(\{[^}]*\}|\[[^\]]*\]|[^,;]+)' % re.escape(name), text)
+    if not match:
+        return None
+    value = match.group(1).strip()
+    if value.startswith('['):
+        lo, hi = (v.strip() for v in value[1:-1].split(',')[:2])
+        return ('range', lo, hi)
+    if value.startswith('{'):
+        return [v.strip().strip('"') for v in value[1:-1].split(',')]
+    return [value.strip('"')]
+
+def _fraction(value: str) -> float:
+    num, _, den = value.partition('/')
+    return int(num) / int(den or 1)
+
+def modes_from_caps(caps) -> list[CameraMode]:
+    """Returns the capture modes described by a Gst.Caps (or its string form)."""
+    text = caps if isinstance(caps, str) else caps.to_string()
+    modes = []
+    for structure in text.split(';'):
+        structure = structure.strip()
+        name = structure.split(',', 1)[0].strip()
+        if name == 'image/jpeg':
+            formats = ['JPEG']
+        elif name == 'video/x-h264':
+            formats = ['H264']
+        elif name == 'video/x-raw':
+            formats = _field(structure, 'format')
+            if formats is None or formats[0] == 'range':
+                continue
+        else:
+            continue
+        width, height = _field(structure, 'width'), _field(structure, 'height')
+        if width is None or height is None:
+            continue
+        if width[0] == 'range' or height[0] == 'range':
+            width, height = None, None
+        else:
+            width, height = int(width[0]), int(height[0])
+        framerate = _field(structure, 'framerate')
+        if framerate is None or framerate[0] == 'range':
+            framerates = ()
+        else:
+            framerates = tuple(sorted({_fraction(f) for f in framerate if _fraction(f) > 0}, reverse=True))
+        for fmt in formats:
+            modes.append(CameraMode(fmt, width, height, framerates))
+    return modes
+
+def list_devices() -> list:
+    """Returns the video source devices GStreamer knows about."""
+    Gst.init(None)
+    monitor = Gst.DeviceMonitor.new()
+    monitor.add_filter('Video/Source', None)
+    monitor.start()
+    devices = monitor.get_devices() or []
+    monitor.stop()
+    return devices
+
+def _property(device, name: str) -> str:
+    properties = device.get_properties()
+    if properties is None or not properties.has_field(name):
+        return ''
+    return str(properties.get_value(name))
+
+def device_path(device) -> str:
+    """Returns the /dev/video path of a device, or '' if it has none."""
+    for name in ('device.path', 'api.v4l2.path', 'object.path'):
+        path = _property(device, name)
+        if path.startswith('/dev/'):
+            return path
+    return ''
+
+def device_identity(device) -> str:
+    """Returns a cache key that changes if a different camera is plugged into the same port."""
+    return '|'.join((device.get_display_name(), device_path(device),
+                     _property(device, 'device.serial') or _property(device, 'api.v4l2.cap.bus_info')))
+
+def _load_cache(cache_path: str) -> dict:
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _save_cache(cache_path: str, cache: dict) -> None:
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(cache_path, 'w', encoding='utf-8') as f:
+            json.dump(cache, f, indent=1)
+    except OSError as e:
+        print(f"Could not write camera cache {cache_path}: {e}")
+
+def probe_modes(device='/dev/video0', devices=None, cache_path: str = CACHE_PATH, refresh: bool = False) -> list[CameraMode]:
+    '''
+    Get every capture mode (format, resolution and frame rates) of a camera.
+
+    Args:
+        device (str | int): The /dev/video path or camera ID. Defaults to '/dev/video0'.
+        devices (list, optional): Gst.Device-like objects to search instead of the DeviceMonitor.
+        cache_path (str, optional): The cache file, None to disable caching. Defaults to CACHE_PATH.
+        refresh (bool, optional): Probe again even if the camera is cached. Defaults to False.
+
+    Returns:
+        list[CameraMode]: The modes of the camera, empty if it was not found.
     '''
-    Get the resolution of the camera with the given camera_id. Uses OpenCV to get the resolution.
+    path = '/dev/video{}'.format(device) if isinstance(device, int) else device
+    if devices is None:
+        devices = list_devices()
+    matches = [d for d in devices if device_path(d) == path] or [d for d in devices if d.get_display_name() == path]
+    if not matches:
+        return []
+    key = device_identity(matches[0])
+    cache = _load_cache(cache_path) if cache_path else {}
+    if key in cache and not refresh:
+        return [CameraMode(fmt, w, h, tuple(rates)) for fmt, w, h, rates in cache[key]]
+    modes = modes_from_caps(matches[0].get_caps())
+    if cache_path:
+        cache[key] = [list(mode) for mode in modes]
+        _save_cache(cache_path, cache)
+    return modes
+
+def mode_cost(mode: CameraMode, inference_size: tuple, framerate: float = 30) -> float:
+    '''
+    Estimate the relative per-frame cost of turning frames of a mode into model input.
+
+    Every source pixel has to be converted and scaled, so the cost grows with the source area
+    and the conversion cost of its format. Letterboxing wastes model input on padding,
+    upscaling loses detail, and a mode slower than the wanted frame rate starves the model.
 
     Args:
-        camera_id (int): The camera ID to get the resolution of. Defaults to 0.
+        mode (CameraMode): The capture mode.
+        inference_size (tuple): The width and height of the model input.
+        framerate (float, optional): The wanted frame rate. Defaults to 30.
+
+    Returns:
+        float: The cost; lower is better.
+    '''
+    inf_w, inf_h = inference_size
+    width, height = (mode.width, mode.height) if mode.width else (inf_w, inf_h)
+    pixels = (width * height) / (inf_w * inf_h)
+    conversion = CONVERSION_COST.get(mode.format, DEFAULT_CONVERSION_COST)
+    cost = pixels * (1.0 + conversion)
+    # Fraction of the model input that is letterbox padding
+    scale = min(inf_w / width, inf_h / height)
+    cost += 4.0 * (1.0 - (width * scale * height * scale) / (inf_w * inf_h))
+    if width < inf_w and height < inf_h:
+        cost += 4.0 * (1.0 - max(width / inf_w, height / inf_h))
+    if mode.max_framerate < framerate:
+        cost += 8.0 * (1.0 - mode.max_framerate / framerate)
+    return cost
+
+def select_mode(modes: list[CameraMode], inference_size: tuple, framerate: float = 30) -> CameraMode:
+    '''Returns the mode with the lowest mode_cost, or None if there are no modes.'''
+    return min(modes, key=lambda mode: mode_cost(mode, inference_size, framerate), default=None)
+
+def get_best_mode(inference_size: tuple, device='/dev/video0', framerate: float = 30, videofmt: str = None) -> CameraMode:
+    '''
+    Get the capture mode of a camera that is cheapest to turn into model input.
+
+    Args:
+        inference_size (tuple): The width and height of the model input.
+        device (str | int): The /dev/video path or camera ID. Defaults to '/dev/video0'.
+        framerate (float, optional): The wanted frame rate. Defaults to 30.
+        videofmt (str, optional): Only consider modes of this run_pipeline videofmt. Defaults to None (any).
+
+    Returns:
+        CameraMode: The selected mode, or None if the camera could not be probed.
+    '''
+    modes = [m for m in probe_modes(device) if videofmt is None or m.videofmt == videofmt]
+    return select_mode(modes, inference_size, framerate)
+
+def get_format(device, size: tuple, videofmt: str = 'raw') -> str:
+    '''
+    Get the raw pixel format a camera delivers at the given size that is cheapest to convert.
+
+    Args:
+        device (str | int): The /dev/video path or camera ID.
+        size (tuple): The capture width and height.
+        videofmt (str, optional): The run_pipeline videofmt. Defaults to 'raw'.
+
+    Returns:
+        str: The format (e.g. 'YUY2'), or None if the camera has no such raw mode.
+    '''
+    if videofmt != 'raw':
+        return None
+    modes = [m for m in probe_modes(device) if m.videofmt == 'raw' and (m.width, m.height) == tuple(size)]
+    mode = min(modes, key=lambda m: CONVERSION_COST.get(m.format, DEFAULT_CONVERSION_COST), default=None)
+    return mode.format if mode else None
+
+def get_resolution(camera_id, inference_size: tuple, framerate: float = 30, videofmt: str = 'raw') -> tuple:
+    '''
+    Get the capture resolution of a video source: the size of the camera mode that is cheapest
+    to turn into model input (see select_mode), probed through GStreamer. Falls back to the
+    default OpenCV resolution if the camera can't be probed, and to DEFAULT_RESOLUTION for
+    sources that are not cameras.
+
+    Args:
+        camera_id (int | str): The camera ID, or the video source, e.g. '/dev/video0'.
+        inference_size (tuple): The width and height of the model input.
+        framerate (float, optional): The wanted frame rate. Defaults to 30.
+        videofmt (str, optional): The run_pipeline videofmt the source is captured in. Defaults to 'raw'.
 
     Returns:
         tuple: A tuple containing the width and height of the camera.
     '''
-    cap = cv2.VideoCapture(camera_id)
+    device = '/dev/video{}'.format(camera_id) if isinstance(camera_id, int) else camera_id
+    if not device.startswith('/dev/video'):
+        return DEFAULT_RESOLUTION
+    mode = get_best_mode(inference_size, device, framerate, videofmt)
+    if mode and mode.width:
+        return (mode.width, mode.height)
+
+    import cv2
+    cap = cv2.VideoCapture(device)
     width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
     height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
     cap.release()
@@ -23,4 +271,4 @@ def get_razer_kiyo_resolution() -> tuple:
     Returns:
         tuple: A tuple containing the width and height of the Razer Kiyo camera.
     '''
-    return (864, 480)
\ No newline at end of file
+    return (864, 480)
@@ -0,0 +1,171 @@
+"""
+cascade.py
+Second detection stage: classifies or embeds the crops of selected detections with a small
+model, to reject false positives and tell people apart.
+"""
+
+import numpy as np
+from . import common
+from . import detect
+
+
+def make_classifier(model_file, cpu=False):
+    """Returns the interpreter of a second-stage model, on the Edge TPU or the CPU."""
+    if cpu:
+        return common.tflite.Interpreter(model_path=model_file)
+    return common.make_interpreter(model_file)
+
+
+class CropCascade:
+    """Runs the crops of one frame's detections through a second model in one batch.
+
+    At most crop_budget detections of class_ids are cropped per frame, closest first, so the
+    second stage adds a bounded cost whatever the scene. The crops are cut from the frame the
+    detector saw and resized to the model input in one vectorized nearest-neighbour pass. If
+    the model accepts a batch dimension (e.g. a CPU model) the batch runs in one invoke;
+    otherwise (e.g. an Edge TPU model compiled for batch 1) the crops are invoked one by one.
+
+    The model output of each crop is attached as the detection's features: unit-length for
+    output='embedding', as-is for output='scores'. With output='scores' and positive_index set,
+    detections scoring below min_score at positive_index are dropped as false positives; kept
+    holds the indices of the detections run() returned, e.g. for OutputBuffers.select().
+    """
+    def __init__(self, interpreter, crop_budget=4, class_ids=(0,), output='embedding',
+                 positive_index=None, min_score=0.5):
+        assert output in ('embedding', 'scores'), 'Unsupported cascade output: {}'.format(output)
+        self.interpreter = interpreter
+        self.crop_budget = crop_budget
+        self.class_ids = set(class_ids)
+        self.output = output
+        self.positive_index = positive_index
+        self.min_score = min_score
+        details = interpreter.get_input_details()[0]
+        self._index = details['index']
+        _, self.height, self.width, _ = details['shape']
+        self._float_input = details['dtype'] == np.float32
+        self.batched = False
+        if crop_budget > 1:
+            try:
+                interpreter.resize_tensor_input(self._index, [crop_budget, self.height, self.width, 3])
+                interpreter.allocate_tensors()
+                self.batched = True
+            except (ValueError, RuntimeError):
+                interpreter.resize_tensor_input(self._index, [1, self.height, self.width, 3])
+                interpreter.allocate_tensors()
+        else:
+            interpreter.allocate_tensors()
+        self._batch = np.zeros((crop_budget, self.height, self.width, 3), dtype=np.uint8)
+        # Sample positions of the output pixels within a crop, in 0..1
+        self._grid_y = (np.arange(self.height, dtype=np.float32) + 0.5) / self.height
+        self._grid_x = (np.arange(self.width, dtype=np.float32) + 0.5) / self.width
+        self.crops_run = 0
+        self.crops_skipped = 0
+        self.kept = []  # Indices into the objs of the last run() that it returned
+
+    def _crop(self, frame, boxes):
+        """Resizes the [xmin, ymin, xmax, ymax] boxes of frame into the first rows of the batch."""
+        frame_h, frame_w = frame.shape[:2]
+        ys = boxes[:, 1, np.newaxis] + (boxes[:, 3] - boxes[:, 1])[:, np.newaxis] * self._grid_y
+        xs = boxes[:, 0, np.newaxis] + (boxes[:, 2] - boxes[:, 0])[:, np.newaxis] * self._grid_x
+        rows = np.clip((ys * frame_h).astype(np.intp), 0, frame_h - 1)
+        cols = np.clip((xs * frame_w).astype(np.intp), 0, frame_w - 1)
+        self._batch[:len(boxes)] = frame[rows[:, :, np.newaxis], cols[:, np.newaxis, :]]
+
+    def _input(self, crops):
+        return crops.astype(np.float32) / 255.0 if self._float_input else crops
+
+    def _invoke(self, n):
+        """Returns the model output for the first n crops of the batch, one row per crop."""
+        if self.batched:
+            self.interpreter.tensor(self._index)()[:] = self._input(self._batch)
+            self.interpreter.invoke()
+            features = common.output_tensor(self.interpreter, 0).reshape(self.crop_budget, -1)[:n].copy()
+        else:
+            rows = []
+            for crop in self._batch[:n]:
+                self.interpreter.tensor(self._index)()[0] = self._input(crop)
+                self.interpreter.invoke()
+                rows.append(common.output_tensor(self.interpreter, 0).reshape(-1).copy())
+            features = np.stack(rows)
+        if self.output == 'embedding':
+            features /= np.maximum(np.linalg.norm(features, axis=1, keepdims=True), 1e-9)
+        return features
+
+    def run(self, frame, objs):
+        """Returns objs with the second-stage features attached.
+
+        Args:
+            frame (ndarray): The (height, width, 3) frame the detector saw, e.g. common.input_tensor().
+            objs (list[Object]): The detections of the frame.
+        """
+        candidates = [i for i, obj in enumerate(objs) if obj.id in self.class_ids]
+        self.kept = range(len(objs))
+        if not candidates:
+            return objs
+        # Closest first, the same ranking as get_closest_obj
+        distances = detect.get_distances([objs[i] for i in candidates])
+        chosen = [candidates[i] for i in np.argsort(distances, kind='stable')[:self.crop_budget]]
+        self.crops_skipped += len(candidates) - len(chosen)
+        self.crops_run += len(chosen)
+        self._crop(frame, np.array([objs[i].bbox[:4] for i in chosen], dtype=np.float32))
+        features = self._invoke(len(chosen))
+        objs = list(objs)
+        rejected = set()
+        for i, row in zip(chosen, features):
+            objs[i] = objs[i]._replace(features=row)
+            if self.output == 'scores' and self.positive_index is not None and row[self.positive_index] < self.min_score:
+                rejected.add(i)
+        if rejected:
+            self.kept = [i for i in range(len(objs)) if i not in rejected]
+        return [objs[i] for i in self.kept]
+
+
+class MeanColorInterpreter:
+    """Stand-in for a tflite Interpreter of an embedding model: embeds an image as the mean
+    colour of each of its quadrants. Accepts any batch size."""
+    def __init__(self, size=(64, 128)):
+        width, height = size
+        self._input = np.zeros((1, height, width, 3), dtype=np.uint8)
+        self._output = np.zeros((1, 12), dtype=np.float32)
+
+    def get_input_details(self):
+        return [{'index': 0, 'shape': np.array(self._input.shape), 'dtype': np.uint8}]
+
+    def get_output_details(self):
+        return [{'index': 1}]
+
+    def resize_tensor_input(self, index, shape):
+        self._input = np.zeros(shape, dtype=np.uint8)
+        self._output = np.zeros((shape[0], 12), dtype=np.float32)
+
+    def allocate_tensors(self):
+        pass
+
+    def tensor(self, index):
+        return lambda: self._input if index == 0 else self._output
+
+    def invoke(self):
+        n, h, w, _ = self._input.shape
+        quadrants = self._input.reshape(n, 2, h // 2, 2, w // 2, 3).mean(axis=(2, 4))
+        self._output[:] = quadrants.reshape(n, 12)
+
+
+if __name__ == '__main__':
+    # Embed two people in differently coloured clothes and compare their crops across frames
+    import time
+    rng = np.random.default_rng(0)
+    frame = rng.integers(0, 60, (300, 300, 3), dtype=np.uint8)
+    frame[60:280, 30:110] = (200, 40, 40)
+    frame[50:270, 180:260] = (40, 40, 200)
+    objs = [detect.Object(0, 0.9, detect.BBox(0.1, 0.2, 0.37, 0.93, 0.19)),
+            detect.Object(0, 0.8, detect.BBox(0.6, 0.17, 0.87, 0.9, 0.19)),
+            detect.Object(62, 0.7, detect.BBox(0.4, 0.5, 0.5, 0.6, 0.01))]
+    cascade = CropCascade(MeanColorInterpreter(), crop_budget=4)
+    start = time.monotonic()
+    result = cascade.run(frame, objs)
+    print('Batched: {}, {:.2f} ms'.format(cascade.batched, (time.monotonic() - start) * 1000))
+    shifted = [obj._replace(bbox=obj.bbox._replace(xmin=obj.bbox.xmin + 0.02, xmax=obj.bbox.xmax + 0.02))
+               for obj in objs]
+    later = cascade.run(frame, shifted)
+    for a in result[:2]:
+        print(' '.join('{:.3f}'.format(float(a.features @ b.features)) for b in later[:2]))
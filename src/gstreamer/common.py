@@ -52,16 +52,65 @@ def set_input(interpreter, buf):
         input_tensor(interpreter)[:, :] = np_buffer
         buf.unmap(mapinfo)
 
-def output_tensor(interpreter, i):
-    """Returns dequantized output tensor if quantized before."""
+def output_tensor(interpreter, i, out=None):
+    """Returns dequantized output tensor if quantized before.
+
+    If out is given, the result is written into it instead of a newly allocated array.
+    """
     output_details = interpreter.get_output_details()[i]
     output_data = np.squeeze(interpreter.tensor(output_details['index'])())
     if 'quantization' not in output_details:
-        return output_data
+        if out is None:
+            return output_data
+        np.copyto(out, output_data)
+        return out
     scale, zero_point = output_details['quantization']
     if scale == 0:
-        return output_data - zero_point
-    return scale * (output_data - zero_point)
+        return np.subtract(output_data, zero_point, out=out)
+    out = np.subtract(output_data, zero_point, out=out, dtype=np.float32)
+    return np.multiply(out, scale, out=out)
+
+class MotionGate:
+    """Cheap scene-change detector used to skip inference on static frames.
+
+    Compares a strided, downscaled view of the green channel of each frame with the last frame
+    that was inferred. A frame is considered changed if the mean absolute difference exceeds
+    threshold, or if max_skip frames were skipped in a row so detections are refreshed anyway.
+    """
+    def __init__(self, shape, threshold=4.0, step=8, max_skip=30):
+        height, width, _ = shape
+        self.shape = shape
+        self.threshold = threshold
+        self.step = step
+        self.max_skip = max_skip
+        self.skipped = 0
+        small = (len(range(0, height, step)), len(range(0, width, step)))
+        self._reference = None
+        self._current = np.empty(small, dtype=np.int16)
+        self._diff = np.empty(small, dtype=np.int16)
+
+    def changed(self, buf):
+        """Returns True if the frame in buf should be inferred."""
+        result, mapinfo = buf.map(Gst.MapFlags.READ)
+        if not result:
+            return True
+        frame = np.frombuffer(mapinfo.data, dtype=np.uint8).reshape(self.shape)
+        np.copyto(self._current, frame[::self.step, ::self.step, 1])
+        buf.unmap(mapinfo)
+
+        if self._reference is not None and self.skipped < self.max_skip:
+            np.subtract(self._current, self._reference, out=self._diff)
+            np.abs(self._diff, out=self._diff)
+            if self._diff.mean() < self.threshold:
+                self.skipped += 1
+                return False
+        # Inferred frames become the new reference so slow drift still adds up.
+        if self._reference is None:
+            self._reference = self._current.copy()
+        else:
+            np.copyto(self._reference, self._current)
+        self.skipped = 0
+        return True
 
 def avg_fps_counter(window_size):
     window = collections.deque(maxlen=window_size)
@@ -5,12 +5,29 @@ TEST_DATA=../all_models
 
 import collections
 from . import common
+from . import ranging
 import numpy as np
 import re
 import svgwrite
 
 
-Object = collections.namedtuple('Object', ['id', 'score', 'bbox'])
+# Distance estimates of get_closest_obj and is_too_close; calibrated if a calibration was saved.
+range_estimator = ranging.RangeEstimator.load()
+
+# track_id is the SORT track the detection belongs to, or None without a tracker; features is
+# the second-stage output for the detection's crop (see cascade.py), or None.
+Object = collections.namedtuple('Object', ['id', 'score', 'bbox', 'track_id', 'features'], defaults=[None, None])
+
+# COCO classes of things on the floor the droid can run into, by class id.
+OBSTACLE_CLASSES = (
+    1, 2, 3, 10, 13, 14, 16, 17,    # bicycle, car, motorcycle, fire hydrant, parking meter, bench, cat, dog
+    26, 27, 30, 32, 36, 40, 43,     # backpack, umbrella, handbag, suitcase, sports ball, skateboard, bottle
+    61, 62, 63, 64, 66, 69,         # chair, couch, potted plant, bed, dining table, toilet
+    78, 80, 81, 85,                 # oven, sink, refrigerator, vase
+)
+# The classes the follow logic acts on: people and obstacles.
+FOLLOW_CLASSES = (0,) + OBSTACLE_CLASSES
+assert set(FOLLOW_CLASSES) <= set(ranging.REFERENCE_SIZES), 'every followed class needs a reference size'
 
 
 def load_labels(path):
@@ -26,7 +43,8 @@ def shadow_text(dwg, x, y, text, font_size=20):
 
 
 def generate_svg(src_size, inference_size, inference_box, objs, labels, text_lines, trdata, trackerFlag):
-    dwg = svgwrite.Drawing('', size=src_size)
+    # debug=False skips svgwrite's per-attribute validation, which is slow and caches values.
+    dwg = svgwrite.Drawing('', size=src_size, debug=False)
     src_w, src_h = src_size
     inf_w, inf_h = inference_size
     box_x, box_y, box_w, box_h = inference_box
@@ -34,45 +52,46 @@ def generate_svg(src_size, inference_size, inference_box, objs, labels, text_lin
 
     for y, line in enumerate(text_lines, start=1):
         shadow_text(dwg, 10, y*20, line)
-    if trackerFlag and (np.array(trdata)).size:
-        for td in trdata:
-            x0, y0, x1, y1, trackID = td[0].item(), td[1].item(
-            ), td[2].item(), td[3].item(), td[4].item()
+    if trackerFlag and len(trdata):
+        # One conversion to Python floats instead of a NumPy scalar per coordinate.
+        for x0, y0, x1, y1, trackID in np.asarray(trdata)[:, :5].tolist():
             overlap = 0
+            obj = None
             for ob in objs:
-                dx0, dy0, dx1, dy1 = ob.bbox.xmin.item(), ob.bbox.ymin.item(
-                ), ob.bbox.xmax.item(), ob.bbox.ymax.item()
+                dx0, dy0, dx1, dy1 = ob.bbox.xmin, ob.bbox.ymin, ob.bbox.xmax, ob.bbox.ymax
                 area = (min(dx1, x1)-max(dx0, x0))*(min(dy1, y1)-max(dy0, y0))
                 if (area > overlap):
                     overlap = area
                     obj = ob
+            if obj is None:
+                continue
 
             # Relative coordinates.
             x, y, w, h = x0, y0, x1 - x0, y1 - y0
             # Absolute coordinates, input tensor space.
-            x, y, w, h = np.int16(x * inf_w), np.int16(y * inf_h), np.int16(w * inf_w), np.int16(h * inf_h)
+            x, y, w, h = int(x * inf_w), int(y * inf_h), int(w * inf_w), int(h * inf_h)
             # Subtract boxing offset.
             x, y = x - box_x, y - box_y
             # Scale to source coordinate space.
             x, y, w, h = x * scale_x, y * scale_y, w * scale_x, h * scale_y
-            percent = np.uint8(100 * obj.score)
+            percent = int(100 * obj.score)
             label = '{}% {} ID:{}'.format(
-                percent, labels.get(obj.id, obj.id), np.uint8(trackID))
+                percent, labels.get(obj.id, obj.id), int(trackID))
             shadow_text(dwg, x, y - 5, label)
             dwg.add(dwg.rect(insert=(x, y), size=(w, h),
                              fill='none', stroke='red', stroke_width='2'))
     else:
         for obj in objs:
-            x0, y0, x1, y1, a = list(obj.bbox)
+            x0, y0, x1, y1, a = obj.bbox
             # Relative coordinates.
             x, y, w, h = x0, y0, x1 - x0, y1 - y0
             # Absolute coordinates, input tensor space.
-            x, y, w, h = np.int16(x * inf_w), np.int16(y * inf_h), np.int16(w * inf_w), np.int16(h * inf_h)
+            x, y, w, h = int(x * inf_w), int(y * inf_h), int(w * inf_w), int(h * inf_h)
             # Subtract boxing offset.
             x, y = x - box_x, y - box_y
             # Scale to source coordinate space.
             x, y, w, h = x * scale_x, y * scale_y, w * scale_x, h * scale_y
-            percent = np.uint8(100 * obj.score)
+            percent = int(100 * obj.score)
             label = '{}% {}'.format(percent, labels.get(obj.id, obj.id))
             shadow_text(dwg, x, y - 5, label)
             dwg.add(dwg.rect(insert=(x, y), size=(w, h),
@@ -88,55 +107,167 @@ class BBox(collections.namedtuple('BBox', ['xmin', 'ymin', 'xmax', 'ymax', 'area
     __slots__ = ()
 
 
-def get_output(interpreter, score_threshold, top_k, image_scale=1.0):
-    """Returns list of detected objects."""
-    boxes = common.output_tensor(interpreter, 0)
-    category_ids = common.output_tensor(interpreter, 1)
-    scores = common.output_tensor(interpreter, 2)
-
-    def make(i):
-        ymin, xmin, ymax, xmax = boxes[i]
-        return Object(
-            id=np.uint8(category_ids[i]), 
-            score=np.float16(scores[i]), 
-            bbox=BBox(
-                xmin=np.float16(np.maximum(0.0, xmin)), 
-                ymin=np.float16(np.maximum(0.0, ymin)), 
-                xmax=np.float16(np.minimum(1.0, xmax)), 
-                ymax=np.float16(np.minimum(1.0, ymax)), 
-                area=np.float16((xmax - xmin) * (ymax - ymin))
-            )
-        )
-    return [make(i) for i in range(top_k) if scores[i] >= score_threshold]
+class OutputBuffers:
+    """Arrays reused by get_output across frames so the steady-state frame path does not
+    allocate NumPy arrays. One instance per interpreter output stream (e.g. per camera).
+    """
+    def __init__(self, interpreter, top_k, class_ids=None, num_classes=256):
+        """
+        Args:
+            class_ids (iterable, optional): The class ids get_output keeps, None for all. Defaults to None.
+        """
+        output_details = interpreter.get_output_details()
+        shape = lambda i: np.squeeze(interpreter.tensor(output_details[i]['index'])()).shape
+        self.top_k = top_k
+        self.boxes = np.empty(shape(0), dtype=np.float32)
+        self.category_ids = np.empty(shape(1), dtype=np.float32)
+        self.scores = np.empty(shape(2), dtype=np.float32)
+        k = min(top_k, len(self.scores))
+        self.keep = np.empty(k, dtype=bool)
+        self.area = np.empty(k, dtype=np.float32)
+        # Rows of [xmin, ymin, xmax, ymax, score]; the first `count` rows are this frame's
+        # detections, in the format the SORT tracker expects.
+        self.detections = np.empty((k, 5), dtype=np.float32)
+        self.ids = np.empty(k, dtype=np.int32)
+        self.count = 0
+        # Lookup table of allowed class ids, so filtering is one gather per frame
+        self.allowed = None
+        if class_ids is not None:
+            self.allowed = np.zeros(num_classes, dtype=bool)
+            self.allowed[list(class_ids)] = True
+            self.allowed_mask = np.empty(k, dtype=bool)
+
+    def select(self, index):
+        """Keeps only the detection rows at index (ascending), compacted to the front in order."""
+        count = len(index)
+        self.detections[:count] = self.detections[index]
+        self.area[:count] = self.area[index]
+        self.ids[:count] = self.ids[index]
+        self.count = count
+
+
+def get_output(interpreter, score_threshold, top_k, image_scale=1.0, buffers=None, nms_iou=None):
+    """Returns list of detected objects.
+
+    With buffers (an OutputBuffers), dequantization and box clipping reuse its arrays and
+    buffers.detections[:buffers.count] holds the detections as tracker input. Classes outside
+    the buffers' class_ids are dropped with the scores below score_threshold. With nms_iou,
+    boxes overlapping a higher scoring box of any class by more than nms_iou are dropped too,
+    so one object detected as e.g. both a person and a teddy bear is reported once.
+    """
+    if buffers is None:
+        buffers = OutputBuffers(interpreter, top_k)
+    boxes = common.output_tensor(interpreter, 0, buffers.boxes)
+    category_ids = common.output_tensor(interpreter, 1, buffers.category_ids)
+    scores = common.output_tensor(interpreter, 2, buffers.scores)
+
+    k = len(buffers.keep)
+    keep, area, detections = buffers.keep, buffers.area, buffers.detections
+    np.greater_equal(scores[:k], score_threshold, out=keep)
+    buffers.ids[:] = category_ids[:k]
+    if buffers.allowed is not None:
+        np.take(buffers.allowed, buffers.ids, out=buffers.allowed_mask, mode='clip')
+        np.logical_and(keep, buffers.allowed_mask, out=keep)
+    count = int(np.count_nonzero(keep))
+    buffers.count = count
+    if not count:
+        return []
+    ymin, xmin, ymax, xmax = boxes[:k, 0], boxes[:k, 1], boxes[:k, 2], boxes[:k, 3]
+    # Area of the unclipped box.
+    np.subtract(xmax, xmin, out=area)
+    np.multiply(area, ymax - ymin, out=area)
+    np.maximum(xmin, 0.0, out=detections[:, 0])
+    np.maximum(ymin, 0.0, out=detections[:, 1])
+    np.minimum(xmax, 1.0, out=detections[:, 2])
+    np.minimum(ymax, 1.0, out=detections[:, 3])
+    detections[:, 4] = scores[:k]
+    if count < k:
+        # Compact the kept rows to the front, preserving model order.
+        buffers.select(np.flatnonzero(keep))
+    if nms_iou is not None and count > 1:
+        index = np.flatnonzero(suppress_duplicates(detections[:count], nms_iou))
+        if len(index) < count:
+            buffers.select(index)
+            count = buffers.count
+
+    return [Object(id=i, score=score, bbox=BBox(xmin=x0, ymin=y0, xmax=x1, ymax=y1, area=a))
+            for i, (x0, y0, x1, y1, score), a in zip(buffers.ids[:count].tolist(),
+                                                     detections[:count].tolist(),
+                                                     area[:count].tolist())]
+
+def box_iou(boxes_a, boxes_b):
+    """Returns the IoU matrix of two arrays of [xmin, ymin, xmax, ymax] rows."""
+    a = np.asarray(boxes_a, dtype=np.float32)[:, np.newaxis, :4]
+    b = np.asarray(boxes_b, dtype=np.float32)[np.newaxis, :, :4]
+    iw = np.clip(np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]), 0, None)
+    ih = np.clip(np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]), 0, None)
+    inter = iw * ih
+    union = ((a[..., 2] - a[..., 0]) * (a[..., 3] - a[..., 1])
+             + (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1]) - inter)
+    return inter / np.maximum(union, 1e-9)
+
+def suppress_duplicates(detections, iou_threshold):
+    """Returns the mask of the [xmin, ymin, xmax, ymax, score] rows that no higher scoring row
+    overlaps by more than iou_threshold, whatever their classes (greedy cross-class NMS)."""
+    order = np.argsort(-detections[:, 4], kind='stable')
+    # overlaps[i, j]: row order[i] outscores row order[j] and covers it
+    overlaps = np.triu(box_iou(detections[order], detections[order]) > iou_threshold, 1)
+    suppressed = np.zeros(len(order), dtype=bool)
+    for i in range(len(order)):
+        if not suppressed[i]:
+            suppressed |= overlaps[i]
+    keep = np.empty(len(order), dtype=bool)
+    keep[order] = ~suppressed
+    return keep
+
+def assign_track_ids(objs, trdata, min_iou=0.3):
+    """Returns objs with track_id set from the SORT rows [xmin, ymin, xmax, ymax, track_id] that
+    overlap them best; objects without a track overlapping by min_iou keep track_id None."""
+    if not objs or not len(trdata):
+        return objs
+    trdata = np.asarray(trdata)
+    ious = box_iou([obj.bbox[:4] for obj in objs], trdata)
+    best = ious.argmax(axis=1)
+    matched = ious[np.arange(len(objs)), best] >= min_iou
+    track_ids = trdata[best, 4].astype(int).tolist()
+    return [obj._replace(track_id=track_id) if ok else obj
+            for obj, track_id, ok in zip(objs, track_ids, matched.tolist())]
 
 def get_proximity(ybbox: float, sections = np.uint8(20)):
     """"Breaks down object in i sections from 0 being furthest to i-1 being closest"""
-    return np.uint8(ybbox * 100) % sections
+    return np.uint8(min(max(int(ybbox * sections), 0), sections - 1))
+
+def get_distances(objs: list[Object], estimator: ranging.RangeEstimator = None) -> np.ndarray:
+    """Returns the estimated distance in metres of every object, in one vectorized step."""
+    estimator = estimator or range_estimator
+    if not objs:
+        return np.empty(0, dtype=np.float32)
+    return estimator.distances([obj.id for obj in objs], [obj.bbox[:4] for obj in objs])
 
-def get_closest_obj(objs: list[Object], min_certainty = np.float16(0.5)) -> Object:
-    """Finds the closest object based on y bottom coordinate, then by area, then finally by score.
+def get_closest_obj(objs: list[Object], min_certainty = np.float16(0.5),
+                    estimator: ranging.RangeEstimator = None) -> Object:
+    """Finds the closest object by its estimated distance.
     Args:
         min_certainty (float, optional): the minimum certainty required for an object to be considered. Defaults to 0.5
+        estimator (RangeEstimator, optional): Defaults to the module's range_estimator.
     Returns:
         Object: Closest object
     """
+    if not objs:
+        return None
+    distances = get_distances(objs, estimator)
     if min_certainty:   # Filter by minimum certainty
-        objs = [obj for obj in objs if obj.score > min_certainty]
-        
-    closest: Object = max(objs, 
-                          key=lambda obj: (get_proximity(obj.bbox.ymax), obj.bbox.area, obj.score), 
-                          default=None
-                          )
-    return closest
-
-def is_too_close(obj: Object, xthreshold = np.float16(0.2), ythreshold = np.float16(0.3)) -> bool:
+        distances[np.array([obj.score for obj in objs]) <= min_certainty] = np.inf
+    closest = int(np.argmin(distances))
+    return objs[closest] if np.isfinite(distances[closest]) else None
+
+def is_too_close(obj: Object, min_distance = 0.8, estimator: ranging.RangeEstimator = None) -> bool:
     """Checks if the given object is too close to the camera.
     Args:
         obj (BBox Object): The object detected in the camera view.
-        threshold (float, optional): The threshold for closeness. Defaults to 0.3.
+        min_distance (float, optional): The closest distance in metres an object may be at. Defaults to 0.8.
+        estimator (RangeEstimator, optional): Defaults to the module's range_estimator.
     Returns:
         bool: True if object is too close to the camera, False otherwise.
     """
-    x_too_close = obj.bbox.xmin < xthreshold and 1 - xthreshold < obj.bbox.xmax
-    y_too_close = obj.bbox.ymin < ythreshold and 1 - ythreshold < obj.bbox.ymax
-    return x_too_close or y_too_close
+    return (estimator or range_estimator).distance(obj.id, obj.bbox) < min_distance
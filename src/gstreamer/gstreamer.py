@@ -12,9 +12,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
 import sys
 import svgwrite
 import threading
+import time
 from .tracker import ObjectTracker
 
 import gi
@@ -26,21 +28,76 @@ from gi.repository import GLib, GObject, Gst, GstBase, Gtk
 GObject.threads_init()
 Gst.init(None)
 
+class FrameScheduler:
+    """Fair round-robin scheduler over the latest frame of each video source.
+
+    Each source holds at most one pending buffer; a newer frame replaces an older one that was
+    never served. Sources are served in round-robin order starting after the last served source,
+    so a fast camera cannot starve a slow one on a shared interpreter. Frames that waited longer
+    than latency_budget seconds are dropped instead of being inferred late.
+    """
+    def __init__(self, num_sources, latency_budget=None, clock=time.monotonic):
+        self.latency_budget = latency_budget
+        self._clock = clock
+        self._pending = [None] * num_sources
+        self._next_source = 0
+        self.served = [0] * num_sources
+        self.dropped = [0] * num_sources
+
+    def put(self, source, buffer):
+        """Queues the newest buffer of a source, replacing its unserved predecessor."""
+        if self._pending[source] is not None:
+            self.dropped[source] += 1
+        self._pending[source] = (buffer, self._clock())
+
+    def ready(self):
+        """Returns True if any source has a pending buffer."""
+        return any(entry is not None for entry in self._pending)
+
+    def pop(self):
+        """Returns the next (source, buffer, arrival_time) to infer, or None if nothing is due."""
+        now = self._clock()
+        num_sources = len(self._pending)
+        for offset in range(num_sources):
+            source = (self._next_source + offset) % num_sources
+            entry = self._pending[source]
+            if entry is None:
+                continue
+            self._pending[source] = None
+            buffer, arrival = entry
+            if self.latency_budget is not None and now - arrival > self.latency_budget:
+                self.dropped[source] += 1
+                continue
+            self._next_source = (source + 1) % num_sources
+            self.served[source] += 1
+            return source, buffer, arrival
+        return None
+
+EMPTY_SVG = '<svg xmlns="http://www.w3.org/2000/svg" width="1" height="1"></svg>'
+
 class GstPipeline:
-    def __init__(self, pipeline, user_function, src_size, mot_tracker):
+    def __init__(self, pipeline, user_function, src_sizes, mot_trackers, latency_budget=None,
+                 encoded_sinks=()):
         self.user_function = user_function
         self.running = False
-        self.gstbuffer = None
-        self.sink_size = None
-        self.src_size = src_size
-        self.box = None
+        self.src_sizes = src_sizes
+        self.sink_sizes = [None] * len(src_sizes)
+        self.boxes = [None] * len(src_sizes)
         self.condition = threading.Condition()
-        self.mot_tracker = mot_tracker
+        self.scheduler = FrameScheduler(len(src_sizes), latency_budget)
+        self.mot_trackers = mot_trackers
+        self.overlay_enabled = True
         self.pipeline = Gst.parse_launch(pipeline)
-        self.overlay = self.pipeline.get_by_name('overlay')
+        self.overlays = [self.pipeline.get_by_name('overlay%d' % i) for i in range(len(src_sizes))]
         self.overlaysink = self.pipeline.get_by_name('overlaysink')
-        appsink = self.pipeline.get_by_name('appsink')
-        appsink.connect('new-sample', self.on_new_sample)
+        self.rates = [self.pipeline.get_by_name('rate%d' % i) for i in range(len(src_sizes))]
+        for i in range(len(src_sizes)):
+            appsink = self.pipeline.get_by_name('appsink%d' % i)
+            appsink.connect('new-sample', self.on_new_sample, i)
+        self.encoded_sinks = list(encoded_sinks)
+        encsink = self.pipeline.get_by_name('encsink')
+        if encsink:
+            encsink.connect('new-sample', self.on_encoded_sample)
 
         # Set up a pipeline bus watch to catch errors.
         bus = self.pipeline.get_bus()
@@ -85,42 +142,92 @@ class GstPipeline:
             Gtk.main_quit()
         return True
 
-    def on_new_sample(self, sink):
+    def on_new_sample(self, sink, source):
         sample = sink.emit('pull-sample')
-        if not self.sink_size:
+        if not self.sink_sizes[source]:
             s = sample.get_caps().get_structure(0)
-            self.sink_size = (s.get_value('width'), s.get_value('height'))
+            self.sink_sizes[source] = (s.get_value('width'), s.get_value('height'))
         with self.condition:
-            self.gstbuffer = sample.get_buffer()
+            self.scheduler.put(source, sample.get_buffer())
             self.condition.notify_all()
         return Gst.FlowReturn.OK
 
-    def get_box(self):
-        if not self.box:
-            glbox = self.pipeline.get_by_name('glbox')
+    def on_encoded_sample(self, sink):
+        # The overlay stream is encoded once; every consumer gets the same bytes.
+        sample = sink.emit('pull-sample')
+        buf = sample.get_buffer()
+        result, mapinfo = buf.map(Gst.MapFlags.READ)
+        if result:
+            data = bytes(mapinfo.data)
+            buf.unmap(mapinfo)
+            keyframe = not buf.has_flags(Gst.BufferFlags.DELTA_UNIT)
+            for encoded_sink in self.encoded_sinks:
+                encoded_sink.push(data, buf.pts, keyframe)
+        return Gst.FlowReturn.OK
+
+    def get_box(self, source=0):
+        if not self.boxes[source]:
+            glbox = self.pipeline.get_by_name('glbox%d' % source)
             if glbox:
                 glbox = glbox.get_by_name('filter')
-            box = self.pipeline.get_by_name('box')
+            box = self.pipeline.get_by_name('box%d' % source)
+            sink_size = self.sink_sizes[source]
             assert glbox or box
-            assert self.sink_size
+            assert sink_size
             if glbox:
-                self.box = (glbox.get_property('x'), glbox.get_property('y'),
+                self.boxes[source] = (glbox.get_property('x'), glbox.get_property('y'),
                         glbox.get_property('width'), glbox.get_property('height'))
             else:
-                self.box = (-box.get_property('left'), -box.get_property('top'),
-                    self.sink_size[0] + box.get_property('left') + box.get_property('right'),
-                    self.sink_size[1] + box.get_property('top') + box.get_property('bottom'))
-        return self.box
+                self.boxes[source] = (-box.get_property('left'), -box.get_property('top'),
+                    sink_size[0] + box.get_property('left') + box.get_property('right'),
+                    sink_size[1] + box.get_property('top') + box.get_property('bottom'))
+        return self.boxes[source]
+
+    def quit(self):
+        """Stops a running pipeline from any thread; run() returns."""
+        GLib.idle_add(Gtk.main_quit)
+
+    def set_framerate(self, framerate):
+        """Caps the frame rate entering the inference branches; None lifts the cap."""
+        for rate in self.rates:
+            if rate:
+                rate.set_property('max-rate', int(framerate) if framerate else 2**31 - 1)
+
+    def set_overlay(self, enabled):
+        """Turns drawing the detection overlays on or off."""
+        self.overlay_enabled = enabled
+        if not enabled:
+            for overlay in self.overlays:
+                if overlay:
+                    overlay.set_property('data', EMPTY_SVG)
+            if self.overlaysink:
+                self.overlaysink.set_property('svg', EMPTY_SVG)
+
+    def capture_time(self, gstbuffer, arrival):
+        """Returns the time.monotonic() a buffer was captured at, from its PTS in pipeline running
+        time, or its arrival time at the appsink if the PTS can't be mapped."""
+        clock = self.pipeline.get_clock()
+        pts = gstbuffer.pts
+        if clock is None or pts == Gst.CLOCK_TIME_NONE:
+            return arrival
+        running_time = clock.get_time() - self.pipeline.get_base_time()
+        age = (running_time - pts) / Gst.SECOND
+        # Sources that don't timestamp in running time give nonsense ages
+        if not 0 <= age < 5:
+            return arrival
+        return time.monotonic() - age
 
     def inference_loop(self):
         while True:
             with self.condition:
-                while not self.gstbuffer and self.running:
+                while not self.scheduler.ready() and self.running:
                     self.condition.wait()
                 if not self.running:
                     break
-                gstbuffer = self.gstbuffer
-                self.gstbuffer = None
+                frame = self.scheduler.pop()
+            if frame is None:
+                continue
+            source, gstbuffer, arrival = frame
 
             # Passing Gst.Buffer as input tensor avoids 2 copies of it:
             # * Python bindings copies the data when mapping gstbuffer
@@ -128,11 +235,12 @@ class GstPipeline:
             # This requires a recent version of the python3-edgetpu package. If this
             # raises an exception please make sure dependencies are up to date.
             input_tensor = gstbuffer
-            svg = self.user_function(input_tensor, self.src_size, self.get_box(), self.mot_tracker)
-            if svg:
-                if self.overlay:
-                    self.overlay.set_property('data', svg)
-                if self.overlaysink:
+            svg = self.user_function(input_tensor, self.src_sizes[source], self.get_box(source),
+                                     self.mot_trackers[source], source, self.capture_time(gstbuffer, arrival))
+            if svg and self.overlay_enabled:
+                if self.overlays[source]:
+                    self.overlays[source].set_property('data', svg)
+                if self.overlaysink and source == 0:
                     self.overlaysink.set_property('svg', svg)
 
     def setup_window(self):
@@ -202,21 +310,45 @@ def detectCoralDevBoard():
   except: pass
   return False
 
-def run_pipeline(user_function,
-                 src_size,
-                 appsink_size,
-                 trackerName,
-                 videosrc='/dev/video1',
-                 videofmt='raw'):
+def make_tracker(trackerName):
+    """Returns the SORT/MediaPipe motion tracker for one video source, or None."""
     objectOfTracker = None
+    if trackerName != None:
+        if trackerName == 'mediapipe':
+            if detectCoralDevBoard():
+                objectOfTracker = ObjectTracker('mediapipe')
+            else:
+                print("Tracker MediaPipe is only available on the Dev Board. Keeping the tracker as None")
+        else:
+            objectOfTracker = ObjectTracker(trackerName)
+    if objectOfTracker:
+        return objectOfTracker.trackerObject.mot_tracker
+    return None
+
+def source_pipeline(videosrc, videofmt='raw', src_format=None, threads=4):
+    """Returns the source part of a pipeline for one video source, ending in decoded frames.
+    Args:
+        videosrc (str): The video source.
+        videofmt (str, optional): The source encoding. Defaults to 'raw'. Choices: ['raw', 'h264', 'jpeg']
+        src_format (str, optional): The raw pixel format to ask the source for, e.g. 'YUY2' or 'RGB'.
+        threads (int, optional): Threads for the conversion of decoded files. Defaults to 4.
+    """
     if videofmt == 'h264':
         SRC_CAPS = 'video/x-h264,width={width},height={height},framerate=30/1'
+        DECODE = ' ! decodebin'
     elif videofmt == 'jpeg':
         SRC_CAPS = 'image/jpeg,width={width},height={height},framerate=30/1'
+        DECODE = ' ! jpegdec'
     else:
         SRC_CAPS = 'video/x-raw,width={width},height={height},framerate=30/1'
+        if src_format:
+            SRC_CAPS = 'video/x-raw,format=%s,width={width},height={height},framerate=30/1'%src_format
+        DECODE = ''
     if videosrc.startswith('/dev/video'):
-        PIPELINE = 'v4l2src device=%s ! {src_caps}'%videosrc
+        PIPELINE = 'v4l2src device=%s ! {src_caps}%s'%(videosrc, DECODE)
+    elif videosrc.startswith('videotestsrc'):
+        # e.g. 'videotestsrc pattern=ball'; live so it paces like a camera.
+        PIPELINE = '%s is-live=true ! {src_caps}'%videosrc
     elif videosrc.startswith('http'):
         PIPELINE = 'souphttpsrc location=%s'%videosrc
     elif videosrc.startswith('rtsp'):
@@ -225,52 +357,196 @@ def run_pipeline(user_function,
         demux =  'avidemux' if videosrc.endswith('avi') else 'qtdemux'
         PIPELINE = """filesrc location=%s ! %s name=demux  demux.video_0
                     ! queue ! decodebin  ! videorate
-                    ! videoconvert n-threads=4 ! videoscale n-threads=4
-                    ! {src_caps} ! {leaky_q} """ % (videosrc, demux)
-    ''' Check for the object tracker.'''
-    if trackerName != None:
-        if trackerName == 'mediapipe':
-            if detectCoralDevBoard():
-                objectOfTracker = ObjectTracker('mediapipe')
-            else:
-                print("Tracker MediaPipe is only available on the Dev Board. Keeping the tracker as None")
-                trackerName = None
+                    ! videoconvert n-threads=%d ! videoscale n-threads=%d
+                    ! {src_caps} ! {leaky_q} """ % (videosrc, demux, threads, threads)
+    return PIPELINE, SRC_CAPS
+
+def encoder_pipeline(encoder='mjpeg', framerate=15, bitrate=2000, quality=85):
+    """Returns a software encoder branch ending in an appsink named encsink.
+    Args:
+        encoder (str, optional): The codec. Defaults to 'mjpeg'. Choices: ['mjpeg', 'h264']
+        framerate (int, optional): The encoded frame rate, independent of the inference rate. Defaults to 15.
+        bitrate (int, optional): The H.264 bitrate in kbit/s. Defaults to 2000.
+        quality (int, optional): The JPEG quality. Defaults to 85.
+    """
+    if encoder == 'h264':
+        # One keyframe per second so new viewers and clips can start decoding quickly.
+        ENCODER = """videoconvert ! video/x-raw,format=I420
+            ! x264enc tune=zerolatency speed-preset=ultrafast bitrate={bitrate} key-int-max={framerate}
+            ! h264parse config-interval=-1 ! video/x-h264,stream-format=byte-stream,alignment=au"""
+    elif encoder == 'mjpeg':
+        ENCODER = 'videoconvert ! jpegenc quality={quality}'
+    else:
+        raise ValueError('Unsupported encoder: {}'.format(encoder))
+    return ('videorate drop-only=true ! video/x-raw,framerate={framerate}/1 ! ' + ENCODER +
+            ' ! appsink name=encsink emit-signals=true sync=false max-buffers=2 drop=true').format(
+            framerate=framerate, bitrate=bitrate, quality=quality)
+
+def plan_inference_branch(src_format, src_size, appsink_size, threads=None, name='box'):
+    """Plans the cheapest element chain turning source frames into letterboxed RGB model input.
+
+    Colour conversion and scaling cost grows with the number of pixels they touch, so the step
+    that runs on fewer pixels goes first: downscaling happens in the source format before
+    conversion, upscaling after it. Steps that would be no-ops are left out.
+    Args:
+        src_format (str): The raw format of decoded source frames, None if unknown.
+        src_size (tuple): The width and height of source frames.
+        appsink_size (tuple): The width and height of the model input.
+        threads (int, optional): Maximum conversion threads. Defaults to the CPU count, at most 4.
+        name (str, optional): The name of the letterboxing videobox. Defaults to 'box'.
+    Returns:
+        tuple: The chain ending in the videobox, and the reason for each choice.
+    """
+    reasons = []
+    threads = threads or min(4, os.cpu_count() or 1)
+    scale = min(appsink_size[0] / src_size[0], appsink_size[1] / src_size[1])
+    scaled = tuple(int(x * scale) for x in src_size)
+    src_pixels = src_size[0] * src_size[1]
+    scaled_pixels = scaled[0] * scaled[1]
+    needs_scale = scaled != tuple(src_size)
+    needs_convert = src_format != 'RGB'
+    scale_first = needs_scale and scaled_pixels < src_pixels
+    converted_size = scaled if scale_first else tuple(src_size)
+    # Thread start-up costs more than it saves on frames around model input size.
+    threads_for = lambda pixels: threads if pixels > 2 * appsink_size[0] * appsink_size[1] else 1
+    scale_threads = threads_for(max(src_pixels, scaled_pixels))
+    convert_threads = threads_for(converted_size[0] * converted_size[1])
+
+    steps = []
+    if needs_scale:
+        factor = max(src_size[0] / scaled[0], src_size[1] / scaled[1])
+        if factor >= 3:
+            method = 'nearest-neighbour'
+            reasons.append('videoscale method=nearest-neighbour: {:.1f}x downscale, filtering costs more than it adds'.format(factor))
         else:
-            objectOfTracker = ObjectTracker(trackerName)
+            method = 'bilinear'
+            reasons.append('videoscale method=bilinear: {:.2f}x scale'.format(1 / scale))
+        steps.append('videoscale method={} n-threads={} ! video/x-raw,width={},height={}'.format(method, scale_threads, *scaled))
     else:
-        pass
-
-    if detectCoralDevBoard():
-        scale_caps = None
-        PIPELINE += """ ! decodebin ! glupload ! tee name=t
-            t. ! queue ! glfilterbin filter=glbox name=glbox ! {sink_caps} ! {sink_element}
-            t. ! queue ! glsvgoverlaysink name=overlaysink
-        """
+        reasons.append('no videoscale: source is already {}x{}'.format(*scaled))
+
+    if needs_convert:
+        converter = 'videoconvert n-threads={}'.format(convert_threads)
+        reasons.append('videoconvert {} -> RGB on {}x{} with {} thread(s)'.format(
+            src_format or 'unknown format', converted_size[0], converted_size[1], convert_threads))
+        if scale_first:
+            steps.append(converter)
+            reasons.append('scale before convert: converts {:.1f}x fewer pixels'.format(src_pixels / scaled_pixels))
+        else:
+            steps.insert(0, converter)
+            if needs_scale:
+                reasons.append('convert before scale: upscaling, so the smaller frame is converted')
     else:
-        scale = min(appsink_size[0] / src_size[0], appsink_size[1] / src_size[1])
-        scale = tuple(int(x * scale) for x in src_size)
-        scale_caps = 'video/x-raw,width={width},height={height}'.format(width=scale[0], height=scale[1])
-        PIPELINE += """ ! tee name=t
-            t. ! {leaky_q} ! videoconvert ! videoscale ! {scale_caps} ! videobox name=box autocrop=true
-               ! {sink_caps} ! {sink_element}
-            t. ! {leaky_q} ! videoconvert
-               ! rsvgoverlay name=overlay ! videoconvert ! ximagesink sync=false
-            """
-    if objectOfTracker:
-        mot_tracker = objectOfTracker.trackerObject.mot_tracker
+        reasons.append('no videoconvert: source already delivers RGB')
+
+    if scaled == tuple(appsink_size):
+        reasons.append('videobox passes frames through: no letterbox needed')
     else:
-        mot_tracker = None
-    SINK_ELEMENT = 'appsink name=appsink emit-signals=true max-buffers=1 drop=true'
-    SINK_CAPS = 'video/x-raw,format=RGB,width={width},height={height}'
-    LEAKY_Q = 'queue max-size-buffers=1 leaky=downstream'
+        reasons.append('videobox letterboxes {}x{} into {}x{}'.format(scaled[0], scaled[1], *appsink_size))
+    steps.append('videobox name={} autocrop=true'.format(name))
+    return ' ! '.join(steps), reasons
 
-    src_caps = SRC_CAPS.format(width=src_size[0], height=src_size[1])
+def make_pipeline(user_function,
+                 src_size,
+                 appsink_size,
+                 trackerName,
+                 videosrc='/dev/video1',
+                 videofmt='raw',
+                 latency_budget=None,
+                 display=True,
+                 encoded_sinks=(),
+                 encoder='mjpeg',
+                 encoder_fps=15,
+                 encoder_bitrate=2000,
+                 src_format=None,
+                 queue_depth=1,
+                 threads=None):
+    """Builds the GStreamer pipeline, calling user_function for every inferred frame once it runs.
+
+    Several cameras can share one interpreter: pass lists for videosrc, and optionally for
+    src_size and videofmt. Every source gets its own appsink, inference box, tracker and overlay,
+    and user_function(input_tensor, src_size, inference_box, mot_tracker, source, captured) is told which
+    source the frame came from and the time.monotonic() it was captured at. A FrameScheduler serves the sources round-robin and drops frames
+    older than latency_budget seconds.
+
+    If encoded_sinks is not empty, the overlay-composited stream of the first camera is encoded
+    once with a software encoder and every encoded frame is pushed to each sink (for example a
+    streaming.StreamServer). display=False drops the local ximagesink window.
+
+    src_format (one per source, or shared) is the raw pixel format to ask the source for; it lets
+    plan_inference_branch leave out conversions the source already did. queue_depth is the number
+    of frames the leaky queues hold, and threads the most conversion threads (default: the CPU
+    count, at most 4).
+
+    Returns:
+        GstPipeline: The pipeline; its run() blocks until the pipeline stops.
+    """
+    videosrcs = [videosrc] if isinstance(videosrc, str) else list(videosrc)
+    num_sources = len(videosrcs)
+    src_sizes = [tuple(src_size)] * num_sources if isinstance(src_size[0], int) else [tuple(s) for s in src_size]
+    videofmts = [videofmt] * num_sources if isinstance(videofmt, str) else list(videofmt)
+    src_formats = list(src_format) if isinstance(src_format, (list, tuple)) else [src_format] * num_sources
+    assert len(src_sizes) == num_sources and len(videofmts) == num_sources and len(src_formats) == num_sources
+    threads = threads or min(4, os.cpu_count() or 1)
+
+    SINK_ELEMENT = 'appsink name=appsink{source} emit-signals=true max-buffers=1 drop=true'
+    SINK_CAPS = 'video/x-raw,format=RGB,width={width},height={height}'
+    LEAKY_Q = 'queue max-size-buffers=%d leaky=downstream' % queue_depth
+    # Drops frames before conversion and inference when a frame rate cap is set
+    RATE = 'videorate name=rate{source} drop-only=true'
     sink_caps = SINK_CAPS.format(width=appsink_size[0], height=appsink_size[1])
-    pipeline = PIPELINE.format(leaky_q=LEAKY_Q,
-        src_caps=src_caps, sink_caps=sink_caps,
-        sink_element=SINK_ELEMENT, scale_caps=scale_caps)
+
+    mot_trackers = [make_tracker(trackerName) for _ in range(num_sources)]
+    branches = []
+    for source, (videosrc, src_size, videofmt, src_format) in enumerate(zip(videosrcs, src_sizes, videofmts, src_formats)):
+        PIPELINE, SRC_CAPS = source_pipeline(videosrc, videofmt, src_format, threads)
+        if detectCoralDevBoard():
+            scale_chain = None
+            PIPELINE += """ ! decodebin ! glupload ! tee name=t{source}
+                t{source}. ! queue ! {rate} ! glfilterbin filter=glbox name=glbox{source} ! {sink_caps} ! {sink_element}
+            """
+            # The dev board has a single fullscreen overlay; it shows the first camera.
+            # The overlay is composited on the GPU, so there is no stream to encode.
+            if encoded_sinks and source == 0:
+                print('Overlay streaming is not available on the Dev Board')
+            if source == 0:
+                PIPELINE += """t{source}. ! queue ! glsvgoverlaysink name=overlaysink
+                """
+        else:
+            if videofmt == 'jpeg' or (videofmt == 'h264' and not src_format):
+                # Decoders output planar YUV
+                src_format = 'I420'
+            elif videofmt == 'raw' and not videosrc.startswith(('/dev/video', 'videotestsrc')):
+                # Files are converted to the source caps format, which is left unspecified
+                src_format = None
+            scale_chain, reasons = plan_inference_branch(src_format, src_size, appsink_size, threads,
+                                                         'box%d' % source)
+            print('Inference branch for source {}:\n  '.format(source) + '\n  '.join(reasons))
+            PIPELINE += """ ! tee name=t{source}
+                t{source}. ! {leaky_q} ! {rate} ! {scale_chain}
+                   ! {sink_caps} ! {sink_element}
+                t{source}. ! {leaky_q} ! videoconvert
+                   ! rsvgoverlay name=overlay{source} ! tee name=ot{source}
+                """
+            outputs = []
+            if display:
+                outputs.append('queue ! videoconvert ! ximagesink sync=false')
+            if encoded_sinks and source == 0:
+                outputs.append('{leaky_q} ! ' + encoder_pipeline(encoder, encoder_fps, encoder_bitrate))
+            if not outputs:
+                outputs.append('fakesink sync=false')
+            for output in outputs:
+                PIPELINE += 'ot{source}. ! ' + output + '\n'
+        src_caps = SRC_CAPS.format(width=src_size[0], height=src_size[1])
+        branches.append(PIPELINE.format(leaky_q=LEAKY_Q, source=source, rate=RATE.format(source=source),
+            src_caps=src_caps, sink_caps=sink_caps,
+            sink_element=SINK_ELEMENT.format(source=source), scale_chain=scale_chain))
+    pipeline = '\n'.join(branches)
 
     print('Gstreamer pipeline:\n', pipeline)
 
-    pipeline = GstPipeline(pipeline, user_function, src_size, mot_tracker)
-    pipeline.run()
+    return GstPipeline(pipeline, user_function, src_sizes, mot_trackers, latency_budget, encoded_sinks)
+
+def run_pipeline(user_function, *args, **kwargs):
+    """Builds the pipeline with make_pipeline() and runs it until it stops."""
+    make_pipeline(user_function, *args, **kwargs).run()
@@ -0,0 +1,212 @@
+"""
+ranging.py
+Distance estimation from detection boxes with a pinhole camera model, per-class reference sizes
+and a one-time focal length calibration.
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import numpy as np
+
+CALIBRATION_PATH = os.path.join(os.path.expanduser('~'), '.config', 'r2arc', 'range.json')
+
+# Typical (height, width) in metres of COCO classes the droid meets indoors, by class id.
+REFERENCE_SIZES = {
+    0: (1.70, 0.45),    # person
+    1: (1.00, 1.70),    # bicycle
+    2: (1.50, 1.80),    # car
+    3: (1.10, 0.80),    # motorcycle
+    10: (0.70, 0.35),   # fire hydrant
+    13: (1.40, 0.30),   # parking meter
+    14: (0.80, 1.50),   # bench
+    16: (0.30, 0.45),   # cat
+    17: (0.55, 0.70),   # dog
+    26: (0.45, 0.30),   # backpack
+    27: (1.00, 1.00),   # umbrella
+    30: (0.30, 0.35),   # handbag
+    32: (0.65, 0.45),   # suitcase
+    36: (0.22, 0.22),   # sports ball
+    40: (0.10, 0.80),   # skateboard
+    43: (0.25, 0.07),   # bottle
+    61: (0.90, 0.50),   # chair
+    62: (0.85, 2.00),   # couch
+    63: (0.60, 0.40),   # potted plant
+    64: (0.60, 2.00),   # bed
+    66: (0.75, 1.50),   # dining table
+    69: (0.75, 0.40),   # toilet
+    71: (0.60, 1.00),   # tv
+    72: (0.25, 0.35),   # laptop
+    78: (0.85, 0.60),   # oven
+    80: (0.30, 0.60),   # sink
+    81: (1.80, 0.70),   # refrigerator
+    85: (0.30, 0.15),   # vase
+}
+DEFAULT_SIZE = (0.50, 0.50)
+
+# Focal length in units of the image height: 0.5 / tan(vertical FOV / 2). 1.2 is a typical
+# ~45 degree webcam; RangeEstimator.calibrated() measures the real value for the camera and letterboxing.
+DEFAULT_FOCAL = 1.2
+
+
+class RangeEstimator:
+    """Maps detection boxes to distances in metres.
+
+    A box of height h (as a fraction of the image height) around an object of real height H is
+    at distance focal * H / h. The division is precomputed into a lookup table over resolution
+    box sizes, so ranking a frame is one vectorized gather and multiply. Both the height and the
+    width give an estimate; a box cut off by the image edge only gets smaller, which
+    overestimates distance, so the nearer of the two is used.
+    """
+    def __init__(self, focal=DEFAULT_FOCAL, aspect=1.0, reference_sizes=REFERENCE_SIZES, resolution=1024,
+                 num_classes=256):
+        """
+        Args:
+            focal (float, optional): Focal length in image heights. Defaults to DEFAULT_FOCAL.
+            aspect (float, optional): Width over height of the image the boxes are normalized to. Defaults to 1.0.
+            reference_sizes (dict, optional): {class id: (height, width)} in metres. Defaults to REFERENCE_SIZES.
+            resolution (int, optional): Lookup table entries. Defaults to 1024.
+            num_classes (int, optional): Class ids covered by the size table. Defaults to 256.
+        """
+        self.focal = focal
+        self.aspect = aspect
+        self.resolution = resolution
+        # Distance per metre of object size, for box sizes 1/resolution .. 1
+        self._lut = (focal * resolution / np.arange(1, resolution + 1)).astype(np.float32)
+        self._heights = np.full(num_classes, DEFAULT_SIZE[0], dtype=np.float32)
+        self._widths = np.full(num_classes, DEFAULT_SIZE[1], dtype=np.float32)
+        for class_id, (height, width) in reference_sizes.items():
+            self._heights[class_id] = height
+            self._widths[class_id] = width
+
+    def _lookup(self, sizes):
+        index = np.clip(np.ceil(sizes * self.resolution).astype(np.intp) - 1, 0, self.resolution - 1)
+        return self._lut[index]
+
+    def distances(self, ids, boxes):
+        """Returns the distance in metres of every box.
+        Args:
+            ids (array): The class id of every box.
+            boxes (array): Rows of [xmin, ymin, xmax, ymax], normalized.
+        """
+        ids = np.asarray(ids, dtype=np.intp)
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        by_height = self._heights[ids] * self._lookup(boxes[:, 3] - boxes[:, 1])
+        # Widths are fractions of the image width, which is aspect image heights
+        by_width = self._widths[ids] * self._lookup(boxes[:, 2] - boxes[:, 0]) / self.aspect
+        return np.minimum(by_height, by_width)
+
+    def distance(self, class_id, box):
+        """Returns the distance in metres of one [xmin, ymin, xmax, ymax] box."""
+        return float(self.distances([class_id], [box[:4]])[0])
+
+    def calibrated(self, samples, reference_sizes=REFERENCE_SIZES):
+        """Returns a new estimator with the focal length fitted to measured samples.
+        Args:
+            samples (list): (class id, [xmin, ymin, xmax, ymax], measured distance) tuples of
+                uncut boxes, e.g. a person standing at 1, 2 and 3 metres.
+        """
+        focals = [distance * (box[3] - box[1]) / reference_sizes.get(class_id, DEFAULT_SIZE)[0]
+                  for class_id, box, distance in samples]
+        return RangeEstimator(float(np.median(focals)), self.aspect, reference_sizes, self.resolution,
+                              len(self._heights))
+
+    def save(self, path=CALIBRATION_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'focal': self.focal, 'aspect': self.aspect}, f, indent=1)
+
+    @classmethod
+    def load(cls, path=CALIBRATION_PATH, **kwargs):
+        """Returns the calibrated estimator stored at path, or an uncalibrated one."""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                calibration = json.load(f)
+        except (OSError, ValueError):
+            return cls(**kwargs)
+        kwargs.update(focal=calibration['focal'], aspect=calibration.get('aspect', 1.0))
+        return cls(**kwargs)
+
+
+def calibrate(videosrc='/dev/video0', path=CALIBRATION_PATH, window=1.0):
+    """Fits the focal length of a camera to a person standing at distances typed in by the user,
+    detected through the DroidVision pipeline, and saves the calibrated estimator to path.
+    Args:
+        videosrc (str, optional): The camera. Defaults to '/dev/video0'.
+        path (str, optional): Where the calibration is saved. Defaults to CALIBRATION_PATH.
+        window (float, optional): Seconds of detections the median box of a distance is taken over. Defaults to 1.0.
+    Returns:
+        RangeEstimator: The calibrated estimator, or None if no samples were taken.
+    """
+    import vision     # Run from src/; only needed to calibrate
+    from benchmark import FakeMovements
+    from . import detect
+    droid = vision.DroidVision(motor=FakeMovements(), videosrc=videosrc, display=False, motion_gate=False)
+    boxes = []      # (time, box) of the largest person of every frame
+    callback = droid._user_callback
+    def sampling_callback(*args):
+        svg = callback(*args)
+        people = [obj.bbox for obj in droid.last_objs[0] if obj.id == 0]
+        if people:
+            boxes.append((time.monotonic(), max(people, key=lambda box: box.area)))
+        return svg
+    droid._user_callback = sampling_callback
+    threading.Thread(target=droid.start, daemon=True).start()
+
+    samples = []
+    print('Stand the person upright and fully in view, measure the distance from the camera and type it in.')
+    while True:
+        text = input('Distance in metres (empty to finish): ').strip()
+        if not text:
+            break
+        try:
+            distance = float(text)
+        except ValueError:
+            print(f"Not a distance: {text}")
+            continue
+        start = time.monotonic()
+        time.sleep(window)
+        heights = sorted((box.ymax - box.ymin, box) for t, box in boxes if t >= start)
+        if not heights:
+            print('No person detected, try again')
+            continue
+        box = heights[len(heights) // 2][1]
+        if box.ymin <= 0.01 or box.ymax >= 0.99:
+            print('The person is cut off by the edge of the view, step further away')
+            continue
+        samples.append((0, box, distance))
+        print('{:.2f} m: box height {:.3f} over {} frames'.format(distance, box.ymax - box.ymin, len(heights)))
+    if droid.pipeline:
+        droid.pipeline.quit()
+    if not samples:
+        return None
+    estimator = detect.range_estimator.calibrated(samples)
+    estimator.save(path)
+    print('Focal length {:.3f} (was {:.3f}), saved to {}'.format(estimator.focal, detect.range_estimator.focal, path))
+    for class_id, box, distance in samples:
+        print('  {:.2f} m measured, {:.2f} m estimated'.format(distance, estimator.distance(class_id, box)))
+    return estimator
+
+
+if __name__ == '__main__':
+    # From src/: python3 -m gstreamer.ranging --calibrate [--videosrc /dev/video0]
+    parser = argparse.ArgumentParser(description='Calibrate the distance estimate of a camera')
+    parser.add_argument('--calibrate', action='store_true', help='Calibrate with a person at measured distances')
+    parser.add_argument('--videosrc', default='/dev/video0', help='The camera to calibrate')
+    parser.add_argument('--path', default=CALIBRATION_PATH, help='Where the calibration is saved')
+    args = parser.parse_args()
+    if args.calibrate:
+        sys.exit(0 if calibrate(args.videosrc, args.path) else 1)
+
+    # Synthetic people at known distances, one cut off at the bottom of the view
+    samples = []
+    for distance in (1.0, 2.0, 3.0, 4.0):
+        h = 0.9 * 1.70 / distance
+        samples.append((0, [0.4, 0.5 - h / 2, 0.4 + h * 0.45 / 1.70, 0.5 + h / 2], distance))
+    estimator = RangeEstimator().calibrated(samples)
+    print('Calibrated focal: {:.3f}'.format(estimator.focal))
+    boxes = np.array([box for _, box, _ in samples] + [[0.3, 0.4, 0.55, 1.0]], dtype=np.float32)
+    print('Distances: ' + ', '.join('{:.2f} m'.format(d) for d in estimator.distances(np.zeros(len(boxes)), boxes)))
@@ -0,0 +1,134 @@
+"""
+recorder.py
+Event-triggered clip recording from the encoded overlay stream with an in-memory pre-roll.
+"""
+
+import collections
+import json
+import os
+import threading
+import time
+
+NS_PER_SECOND = 1000000000
+CLOCK_TIME_NONE = 2**64 - 1     # Gst.CLOCK_TIME_NONE
+
+class Clip:
+    """Frames and detections of one triggered recording, waiting for its post-roll."""
+    def __init__(self, reason: str, frames: list, detections: list, end_pts: int):
+        self.reason = reason
+        self.frames = frames
+        self.detections = detections
+        self.end_pts = end_pts
+
+class ClipRecorder:
+    """Keeps the last pre_roll seconds of encoded video in memory and writes clips on events.
+
+    The pipeline pushes every encoded frame with push(); the inference callback adds each frame's
+    detections with add_detections() using the same buffer PTS. Nothing touches the disk until
+    trigger() is called: the pre-roll plus post_roll seconds of video are then written to a clip
+    file with a JSON-lines sidecar of the detections, on a background thread.
+    """
+    EXTENSIONS = {'h264': '.h264', 'mjpeg': '.mjpeg'}
+
+    def __init__(self, directory: str = '../recordings', codec: str = 'mjpeg', pre_roll: float = 10.0,
+                 post_roll: float = 5.0, max_bytes: int = 64 * 1024 * 1024):
+        """
+        Args:
+            directory (str, optional): Where clips are written. Defaults to '../recordings'.
+            codec (str, optional): The codec of the pushed frames. Defaults to 'mjpeg'. Choices: ['mjpeg', 'h264']
+            pre_roll (float, optional): Seconds of video kept before a trigger. Defaults to 10.
+            post_roll (float, optional): Seconds of video recorded after the last trigger. Defaults to 5.
+            max_bytes (int, optional): Upper bound of the in-memory ring. Defaults to 64 MiB.
+        """
+        assert codec in self.EXTENSIONS, 'Unsupported recording codec: {}'.format(codec)
+        self.directory = directory
+        self.codec = codec
+        self.pre_roll = int(pre_roll * NS_PER_SECOND)
+        self.post_roll = int(post_roll * NS_PER_SECOND)
+        self.max_bytes = max_bytes
+        self._frames = collections.deque()      # (pts, data, keyframe)
+        self._detections = collections.deque()  # (pts, source, detections)
+        self._bytes = 0
+        self._last_pts = 0
+        self._clip = None
+        self._lock = threading.Lock()
+        self.clips_written = 0
+
+    def _pts(self, pts) -> int:
+        if pts is None or pts == CLOCK_TIME_NONE:
+            return time.monotonic_ns()
+        return pts
+
+    def _trim(self) -> None:
+        oldest = self._last_pts - self.pre_roll
+        while self._frames and (self._frames[0][0] < oldest or self._bytes > self.max_bytes):
+            self._bytes -= len(self._frames.popleft()[1])
+        if self.codec == 'h264':
+            # A clip has to start at a keyframe to be decodable
+            while self._frames and not self._frames[0][2]:
+                self._bytes -= len(self._frames.popleft()[1])
+        oldest = self._frames[0][0] if self._frames else self._last_pts
+        while self._detections and self._detections[0][0] < oldest:
+            self._detections.popleft()
+
+    def push(self, data: bytes, pts=None, keyframe: bool = True) -> None:
+        """Adds one encoded frame to the pre-roll ring, or to the clip being recorded."""
+        pts = self._pts(pts)
+        finished = None
+        with self._lock:
+            self._last_pts = pts
+            if self._clip:
+                self._clip.frames.append((pts, data, keyframe))
+                if pts >= self._clip.end_pts:
+                    finished, self._clip = self._clip, None
+            else:
+                self._frames.append((pts, data, keyframe))
+                self._bytes += len(data)
+                self._trim()
+        if finished:
+            threading.Thread(target=self._write, args=(finished,), daemon=True).start()
+
+    def add_detections(self, pts, objs: list, source: int = 0) -> None:
+        """Records the detections inferred from the frame with the given PTS."""
+        detections = [
+            {'id': int(obj.id), 'score': round(float(obj.score), 3),
+             'bbox': [round(float(v), 4) for v in obj.bbox[:4]]}
+            for obj in objs]
+        entry = (self._pts(pts), source, detections)
+        with self._lock:
+            if self._clip:
+                self._clip.detections.append(entry)
+            else:
+                self._detections.append(entry)
+
+    def trigger(self, reason: str) -> None:
+        """Starts a clip with the current pre-roll, or extends the post-roll of the running one."""
+        with self._lock:
+            end_pts = self._last_pts + self.post_roll
+            if self._clip:
+                self._clip.end_pts = max(self._clip.end_pts, end_pts)
+                return
+            self._clip = Clip(reason, list(self._frames), list(self._detections), end_pts)
+            self._frames.clear()
+            self._detections.clear()
+            self._bytes = 0
+        print('Recording clip: {}'.format(reason))
+
+    def _write(self, clip: Clip) -> None:
+        if not clip.frames:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        name = '{}-{}'.format(time.strftime('%Y%m%d-%H%M%S'), clip.reason.replace(' ', '_'))
+        path = os.path.join(self.directory, name)
+        start_pts = clip.frames[0][0]
+        with open(path + self.EXTENSIONS[self.codec], 'wb') as f:
+            for _, data, _ in clip.frames:
+                f.write(data)
+        with open(path + '.jsonl', 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'reason': clip.reason, 'codec': self.codec, 'start_pts': start_pts,
+                                'frame_pts': [pts - start_pts for pts, _, _ in clip.frames]}) + '\n')
+            for pts, source, detections in clip.detections:
+                if pts >= start_pts:
+                    f.write(json.dumps({'pts': pts - start_pts, 'source': source, 'detections': detections}) + '\n')
+        self.clips_written += 1
+        print('Saved clip {}{}'.format(path, self.EXTENSIONS[self.codec]))
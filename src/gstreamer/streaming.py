@@ -0,0 +1,134 @@
+"""
+streaming.py
+Lightweight HTTP server that fans one encoded video stream out to many remote viewers.
+"""
+
+import http.server
+import queue
+import socketserver
+import threading
+
+class StreamClient:
+    """Bounded frame queue of one connected viewer. Slow viewers lose their oldest frames."""
+    def __init__(self, queue_size: int, wait_keyframe: bool):
+        self.frames = queue.Queue(maxsize=queue_size)
+        self.wait_keyframe = wait_keyframe
+        self.dropped = 0
+
+    def offer(self, data: bytes, keyframe: bool) -> None:
+        # H.264 viewers can only start decoding at a keyframe
+        if self.wait_keyframe:
+            if not keyframe:
+                return
+            self.wait_keyframe = False
+        while True:
+            try:
+                self.frames.put_nowait(data)
+                return
+            except queue.Full:
+                try:
+                    self.frames.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class StreamServer:
+    """Serves the encoded overlay stream over HTTP.
+
+    The pipeline encodes the stream once and calls push() for every encoded frame; each viewer
+    gets its own bounded queue, so adding viewers costs no extra encoding and a slow viewer only
+    drops its own frames. MJPEG is served as multipart/x-mixed-replace (viewable in a browser),
+    H.264 as an Annex B byte-stream (viewable with ffplay/VLC).
+    """
+    CONTENT_TYPES = {
+        'mjpeg': 'multipart/x-mixed-replace; boundary=frame',
+        'h264': 'video/h264',
+    }
+
+    def __init__(self, port: int = 8080, codec: str = 'mjpeg', client_queue_size: int = 2, host: str = '0.0.0.0'):
+        """
+        Args:
+            port (int, optional): The TCP port to listen on. Defaults to 8080.
+            codec (str, optional): The codec of the pushed frames. Defaults to 'mjpeg'. Choices: ['mjpeg', 'h264']
+            client_queue_size (int, optional): Frames buffered per viewer before dropping. Defaults to 2.
+            host (str, optional): The address to bind to. Defaults to all interfaces.
+        """
+        assert codec in self.CONTENT_TYPES, 'Unsupported stream codec: {}'.format(codec)
+        self.port = port
+        self.codec = codec
+        self.client_queue_size = client_queue_size
+        self.host = host
+        self.running = False
+        self._clients = set()
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def num_clients(self) -> int:
+        return len(self._clients)
+
+    def start(self) -> None:
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path not in ('/', '/stream'):
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', server.CONTENT_TYPES[server.codec])
+                self.send_header('Cache-Control', 'no-cache, private')
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                server._serve(self.wfile)
+
+            def log_message(self, format, *args):
+                pass    # One line per request would flood the console
+
+        self._server = _ThreadingHTTPServer((self.host, self.port), Handler)
+        self.port = self._server.server_address[1]
+        self.running = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        print('Streaming {} on http://{}:{}/stream'.format(self.codec, self.host, self.port))
+
+    def stop(self) -> None:
+        self.running = False
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def push(self, data: bytes, pts=None, keyframe: bool = True) -> None:
+        """Hands one encoded frame to every connected viewer without blocking the pipeline."""
+        with self._lock:
+            for client in self._clients:
+                client.offer(data, keyframe)
+
+    def _serve(self, wfile) -> None:
+        client = StreamClient(self.client_queue_size, wait_keyframe=self.codec == 'h264')
+        with self._lock:
+            self._clients.add(client)
+        try:
+            while self.running:
+                try:
+                    data = client.frames.get(timeout=1.0)
+                except queue.Empty:
+                    continue
+                if self.codec == 'mjpeg':
+                    wfile.write(b'--frame\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n' % len(data))
+                    wfile.write(data)
+                    wfile.write(b'\r\n')
+                else:
+                    wfile.write(data)
+                wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            with self._lock:
+                self._clients.discard(client)
@@ -1,24 +1,122 @@
 '''
 motors.py
 Motor controller communication via SPI for the R2-ARC project
+
+Two protocols are supported. The byte protocol sends one ASCII command per transaction
+(W/A/S/D/O/P/Q). The framed protocol sends a command with a signed speed and turn rate in one
+transaction of FRAME_LENGTH bytes:
+    [FRAME_HEADER, command, speed, turn, sequence, CRC-8]
+speed and turn are -100..100 percent as two's complement bytes, and the CRC-8 (polynomial 0x07)
+covers the bytes before it. SPI is full duplex, so the controller answers each frame during the
+next transaction with [RESPONSE_HEADER, status, acknowledged sequence, CRC-8] and zero padding.
 '''
 
-import spidev
+import collections
+
+FRAME_HEADER = 0xA5
+RESPONSE_HEADER = 0x5A
+FRAME_LENGTH = 6
+# Framed command byte for proportional speed and turn rate
+DRIVE = ord('M')
+# Response status codes
+STATUS_OK = 0
+STATUS_CRC_ERROR = 1
+STATUS_UNKNOWN_COMMAND = 2
+STATUS_FAULT = 3
+
+# (speed, turn rate) in percent the framed protocol sends with each single-byte command
+COMMAND_MOTION = {
+    'W': (100, 0), 'S': (-100, 0),
+    'A': (70, 50), 'D': (70, -50),
+    'O': (0, 100), 'P': (0, -100),
+    'Q': (0, 0),
+}
+
+Response = collections.namedtuple('Response', ['status', 'ack'])
+
+def _crc8_table(polynomial: int = 0x07) -> bytes:
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ polynomial if crc & 0x80 else crc << 1) & 0xFF
+        table.append(crc)
+    return bytes(table)
+
+_CRC8_TABLE = _crc8_table()
+
+def crc8(data) -> int:
+    """Returns the CRC-8 (polynomial 0x07, initial value 0) of a sequence of bytes."""
+    crc = 0
+    for byte in data:
+        crc = _CRC8_TABLE[crc ^ byte]
+    return crc
+
+def encode_frame(command: int, speed: int, turn: int, sequence: int) -> list[int]:
+    """Returns the FRAME_LENGTH bytes of a framed command; speed and turn are clamped to -100..100."""
+    speed = max(-100, min(100, int(speed))) & 0xFF
+    turn = max(-100, min(100, int(turn))) & 0xFF
+    frame = [FRAME_HEADER, command & 0xFF, speed, turn, sequence & 0xFF]
+    return frame + [crc8(frame)]
+
+def decode_frame(frame) -> tuple:
+    """Returns (command, speed, turn, sequence) of a framed command, or None if it is corrupt."""
+    if len(frame) < FRAME_LENGTH or frame[0] != FRAME_HEADER or crc8(frame[:5]) != frame[5]:
+        return None
+    signed = lambda byte: byte - 256 if byte > 127 else byte
+    return frame[1], signed(frame[2]), signed(frame[3]), frame[4]
+
+def encode_response(status: int, ack: int) -> list[int]:
+    """Returns the FRAME_LENGTH bytes of a controller response."""
+    response = [RESPONSE_HEADER, status & 0xFF, ack & 0xFF]
+    return response + [crc8(response)] + [0] * (FRAME_LENGTH - 4)
+
+def decode_response(data) -> Response:
+    """Returns the Response in the bytes received during a framed transaction, or None if
+    there is none (e.g. the first transaction, or a controller without the framed protocol)."""
+    if len(data) < 4 or data[0] != RESPONSE_HEADER or crc8(data[:3]) != data[3]:
+        return None
+    return Response(data[1], data[2])
+
+def nearest_command(speed: float, turn: float) -> str:
+    """Returns the single-byte command closest to a speed and turn rate in percent."""
+    if abs(speed) < 20:
+        return 'Q' if abs(turn) < 20 else ('O' if turn > 0 else 'P')
+    if speed < 0:
+        return 'S'
+    if abs(turn) < 20:
+        return 'W'
+    return 'A' if turn > 0 else 'D'
 
 class Movements:
-    def __init__(self, spi_channel: int = 0, speed: int = 5000000) -> None:
+    def __init__(self, spi_channel: int = 0, speed: int = 5000000, framed: bool = False,
+                 fallback_after: int = 3, spi=None) -> None:
         """Initializes the Movements class with the specified SPI channel and speed to communicate with the motor controller.
         args:
             spi_channel (int): SPI channel (bus) to use. Default is 0.
             speed (int): SPI communication speed in Hz. Default is 5 MHz (5,000,000 Hz).
+            framed (bool): Use the framed protocol with speed and turn rate. Default is False (byte protocol).
+            fallback_after (int): Consecutive framed transactions without a valid response before falling back to the byte protocol, None to never fall back. Default is 3.
+            spi: An opened spidev.SpiDev or a stand-in with xfer(). Default is None (open spi_channel).
         returns:
             None
         """
         self.spi_channel = spi_channel
         self.speed = speed
-        self.spi = spidev.SpiDev()
-        self.spi.open(0, spi_channel)  # Open SPI port 0, chip select (CS) is set by spi_channel
-        self.spi.max_speed_hz = speed
+        if spi is None:
+            import spidev   # Only needed on the droid
+            spi = spidev.SpiDev()
+            spi.open(0, spi_channel)  # Open SPI port 0, chip select (CS) is set by spi_channel
+            spi.max_speed_hz = speed
+        self.spi = spi
+        self.framed = framed
+        self.fallback_after = fallback_after
+        self.sequence = 0
+        self.last_response = None   # Response to the previous framed transaction
+        self.missed_responses = 0   # Consecutive framed transactions without a valid response
+        self.errors = 0     # Responses with a status other than STATUS_OK
+        self.last_speed = 0
+        self.last_turn = 0
         # Store ASCII values for faster communication
         self._W_ASCII = ord('W')
         self._A_ASCII = ord('A')
@@ -27,6 +125,72 @@ class Movements:
         self._O_ASCII = ord('O')
         self._P_ASCII = ord('P')
         self._Q_ASCII = ord('Q')
+        # Last byte sent to the motor controller, None until the first command
+        self.last_command = None
+
+    def _send(self, command: int, speed: int = None, turn: int = None) -> list[int]:
+        """Sends a command to the motor controller and remembers it.
+
+        With the framed protocol, speed and turn default to the COMMAND_MOTION of the command;
+        the byte protocol ignores them.
+        """
+        self.last_command = command
+        if not self.framed:
+            return self.spi.xfer([command])
+        default_speed, default_turn = COMMAND_MOTION.get(chr(command), (0, 0))
+        self.last_speed = default_speed if speed is None else speed
+        self.last_turn = default_turn if turn is None else turn
+        self.sequence = (self.sequence + 1) & 0xFF
+        received = self.spi.xfer(encode_frame(command, self.last_speed, self.last_turn, self.sequence))
+        if self._check_response(received):
+            # A single-byte controller read the frame bytes as commands of their own: stop
+            # whatever they started, then send this command the way it understands
+            self.spi.xfer([self._Q_ASCII])
+            if command == DRIVE:
+                command = ord(nearest_command(self.last_speed, self.last_turn))
+            return self._send(command)
+        return received
+
+    def _check_response(self, received: list[int]) -> bool:
+        """Parses the controller's response and falls back to the byte protocol if it never answers.
+        returns:
+            bool: True if this response made it fall back.
+        """
+        response = decode_response(received)
+        self.last_response = response
+        if response is None:
+            self.missed_responses += 1
+            if self.fallback_after is not None and self.missed_responses >= self.fallback_after:
+                print(f"Motor controller did not answer {self.missed_responses} framed commands, "
+                      "falling back to single-byte commands")
+                self.framed = False
+                return True
+            return False
+        self.missed_responses = 0
+        if response.status != STATUS_OK:
+            self.errors += 1
+        return False
+
+    def drive(self, speed: float, turn: float) -> list[int]:
+        """Sends a proportional speed and turn rate to the motor controller in one transaction.
+        With the byte protocol the nearest single-byte command is sent instead.
+        args:
+            speed (float): Forward speed in percent, -100..100; negative drives backwards.
+            turn (float): Turn rate in percent, -100..100; positive turns left.
+        returns:
+            list[int]: List containing the received bytes from the motor controller.
+        """
+        command = ord(nearest_command(speed, turn))
+        if not self.framed:
+            return self._send(command)
+        # last_command keeps the nearest single-byte command for the follow logic and telemetry
+        received = self._send(DRIVE, round(speed), round(turn))
+        self.last_command = command
+        return received
+
+    def is_stopped(self) -> bool:
+        """Returns True if no command was sent yet or the last command was a stop."""
+        return self.last_command is None or self.last_command == self._Q_ASCII
 
     # Below methods implement specific movements by sending single-byte commands
     def forward(self) -> list[int]:
@@ -36,7 +200,7 @@ class Movements:
         returns:
             list[int]: List containing the received byte from the motor controller.
         """ 
-        return self.spi.xfer([self._W_ASCII])
+        return self._send(self._W_ASCII)
 
     def left(self) -> list[int]:
         """"Sends the character 'A' to the motor controller via SPI to move the R2-ARC droid left.
@@ -45,7 +209,7 @@ class Movements:
         returns:
             list[int]: List containing the received byte from the motor controller.
         """
-        return self.spi.xfer([self._A_ASCII])
+        return self._send(self._A_ASCII)
 
     def backwards(self) -> list[int]:
         """"Sends the character 'S' to the motor controller via SPI to move the R2-ARC droid backwards.
@@ -54,7 +218,7 @@ class Movements:
         returns:
             list[int]: List containing the received byte from the motor controller.
         """
-        return self.spi.xfer([self._S_ASCII])
+        return self._send(self._S_ASCII)
 
     def right(self) -> list[int]:
         """"Sends the character 'D' to the motor controller via SPI to move the R2-ARC droid right.
@@ -63,7 +227,7 @@ class Movements:
         returns:
             list[int]: List containing the received byte from the motor controller.
         """
-        return self.spi.xfer([self._D_ASCII])
+        return self._send(self._D_ASCII)
 
     def pivot_left(self) -> list[int]:
         """"Sends the character 'O' to the motor controller via SPI to pivot the R2-ARC droid left in place.
@@ -72,7 +236,7 @@ class Movements:
         returns:
             list[int]: List containing the received byte from the motor controller.
         """
-        return self.spi.xfer([self._O_ASCII])
+        return self._send(self._O_ASCII)
 
     def pivot_right(self) -> list[int]:
         """"Sends the character 'P' to the motor controller via SPI to pivot the R2-ARC droid right in place.
@@ -81,7 +245,7 @@ class Movements:
         returns:
             list[int]: List containing the received byte from the motor controller.
         """
-        return self.spi.xfer([self._P_ASCII])
+        return self._send(self._P_ASCII)
 
     def stop(self) -> list[int]:
         """"Sends the character 'Q' to the motor controller via SPI to stop the R2-ARC droid.
@@ -90,7 +254,7 @@ class Movements:
         returns:
             list[int]: List containing the received byte from the motor controller.
         """
-        return self.spi.xfer([self._Q_ASCII])
+        return self._send(self._Q_ASCII)
     
     def send_command(self, command: str) -> list[int]:
         """Sends the specified command to the motor controller.
@@ -99,10 +263,53 @@ class Movements:
         returns:
             list[int]: List containing the received byte from the motor controller.
         """
-        return self.spi.xfer([ord(command)])
+        return self._send(ord(command))
+
+class LoopbackController:
+    """Stand-in for spidev.SpiDev with a motor controller behind it that speaks both protocols.
+    Framed commands are answered during the next transaction, as the real controller does."""
+    def __init__(self, framed: bool = True):
+        self.framed = framed
+        self.received = []  # Decoded framed commands, or single bytes
+        self._reply = [0] * FRAME_LENGTH
+
+    def xfer(self, data: list[int]) -> list[int]:
+        if len(data) == 1:
+            self.received.append(data[0])
+            return [data[0]]
+        reply = self._reply
+        if self.framed:
+            frame = decode_frame(data)
+            if frame is None:
+                self._reply = encode_response(STATUS_CRC_ERROR, 0)
+            else:
+                self.received.append(frame)
+                known = frame[0] == DRIVE or chr(frame[0]) in COMMAND_MOTION
+                self._reply = encode_response(STATUS_OK if known else STATUS_UNKNOWN_COMMAND, frame[3])
+        return reply[:len(data)]
 
 if __name__ == "__main__":
-    import time
+    import sys, time
+    if '--loopback' in sys.argv:
+        # Round-trip both protocols through a fake controller instead of the SPI bus
+        controller = LoopbackController()
+        move = Movements(framed=True, spi=controller)
+        for speed, turn in ((100, 0), (60, 35), (-40, 0), (0, -100), (0, 0)):
+            move.drive(speed, turn)
+            print(f"Sent speed {speed:>4}, turn {turn:>4} as {chr(move.last_command)}; "
+                  f"controller decoded {controller.received[-1]}, response {move.last_response}")
+        corrupt = encode_frame(DRIVE, 50, 0, 99)
+        corrupt[2] ^= 0x01
+        controller.xfer(corrupt)
+        print(f"Corrupted frame answered with {decode_response(controller.xfer(encode_frame(ord('Q'), 0, 0, 100)))}")
+        controller = LoopbackController(framed=False)
+        move = Movements(framed=True, spi=controller)
+        for _ in range(3):
+            move.drive(60, 35)
+        print(f"Controller without framing: framed mode {move.framed}, "
+              f"then received {''.join(chr(byte) for byte in controller.received[-2:])}")
+        sys.exit(0)
+
     # Test the Movements class
     move = Movements()
     commands = {
@@ -0,0 +1,222 @@
+'''
+prediction.py
+Latency compensation for the R2-ARC follow logic: extrapolates detected boxes from the time their
+frame was captured to the time the resulting motor command takes effect.
+'''
+
+import collections
+import numpy
+from gstreamer import detect
+from gstreamer import Object as Object
+
+def _iou(box: numpy.ndarray, boxes: numpy.ndarray) -> numpy.ndarray:
+    """Returns the IoU of one [xmin, ymin, xmax, ymax] box with each row of boxes."""
+    ix = numpy.clip(numpy.minimum(box[2], boxes[:, 2]) - numpy.maximum(box[0], boxes[:, 0]), 0, None)
+    iy = numpy.clip(numpy.minimum(box[3], boxes[:, 3]) - numpy.maximum(box[1], boxes[:, 1]), 0, None)
+    inter = ix * iy
+    union = (box[2] - box[0]) * (box[3] - box[1]) + (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1]) - inter
+    return inter / numpy.maximum(union, 1e-9)
+
+class AlphaBetaFilter:
+    """Alpha-beta filter on the [xmin, ymin, xmax, ymax] box of a single target."""
+    def __init__(self, alpha: float = 0.5, beta: float = 0.2, reset_iou: float = 0.1):
+        self.alpha = alpha
+        self.beta = beta
+        self.reset_iou = reset_iou
+        self.box = None
+        self.velocity = numpy.zeros(4)  # Per second
+        self.time = None
+
+    def update(self, box, time: float) -> numpy.ndarray:
+        """Feeds the measured box at the given time and returns the velocity estimate. The same
+        frame fed again (e.g. by the control loop deciding on it twice) leaves the estimate as is."""
+        box = numpy.asarray(box, dtype=numpy.float64)
+        if self.box is not None and time == self.time:
+            return self.velocity
+        if self.box is None or time < self.time:
+            self.box, self.velocity, self.time = box, numpy.zeros(4), time
+            return self.velocity
+        dt = time - self.time
+        predicted = self.box + self.velocity * dt
+        # A box that doesn't overlap the prediction belongs to a different target
+        if _iou(predicted, box[numpy.newaxis])[0] < self.reset_iou:
+            self.box, self.velocity, self.time = box, numpy.zeros(4), time
+            return self.velocity
+        residual = box - predicted
+        self.box = predicted + self.alpha * residual
+        self.velocity = self.velocity + self.beta * residual / dt
+        self.time = time
+        return self.velocity
+
+# How fast each motor command sweeps the camera view, in view widths per second (positive turns
+# right, shifting objects left in the view). Calibrate on the droid.
+TURN_RATES = {'A': -0.3, 'D': 0.3, 'O': -0.6, 'P': 0.6}
+
+class BoxPredictor:
+    """Extrapolates detections to actuation time.
+
+    The horizon is the measured age of the frame at decision time plus the expected actuation
+    delay of the motor command. Boxes are extrapolated in a heading-stabilised frame: the
+    droid's own turning, integrated from the motor commands it sent, is taken out before
+    estimating how the target moves and put back for the turning still to happen before
+    actuation. Objects matched to a SORT track move with the track's Kalman velocity; without
+    a tracker, the closest human is followed by an AlphaBetaFilter.
+    """
+    def __init__(self, actuation_delay: float = 0.05, max_horizon: float = 0.3, match_iou: float = 0.3,
+                 turn_rates: dict = None):
+        """
+        Args:
+            actuation_delay (float, optional): Seconds from sending a motor command to it taking effect. Defaults to 0.05.
+            max_horizon (float, optional): Longest extrapolation in seconds. Defaults to 0.3.
+            match_iou (float, optional): Minimum IoU between a detection and its track. Defaults to 0.3.
+            turn_rates (dict, optional): View widths per second swept by each command. Defaults to TURN_RATES.
+        """
+        self.actuation_delay = actuation_delay
+        self.max_horizon = max_horizon
+        self.match_iou = match_iou
+        self.turn_rates = TURN_RATES if turn_rates is None else turn_rates
+        self.filter = AlphaBetaFilter()
+        self.horizon = 0.0
+        self._last_update = None
+        self.frame_dt = None    # Measured seconds between tracker updates
+        self._commands = collections.deque(maxlen=256)  # (time, turn rate, heading at time)
+
+    def record_command(self, command, time: float) -> None:
+        """Records a motor command (character or byte) sent at the given time."""
+        if command is None:
+            return
+        rate = self.turn_rates.get(chr(command) if isinstance(command, int) else command, 0.0)
+        if self._commands and self._commands[-1][1] == rate:
+            return
+        self._commands.append((time, rate, self.heading(time)))
+
+    def _rate(self, time: float) -> float:
+        for t, rate, _ in reversed(self._commands):
+            if t <= time:
+                return rate
+        return 0.0
+
+    def heading(self, time: float) -> float:
+        """Returns how far the droid turned by the given time, in view widths."""
+        for t, rate, heading in reversed(self._commands):
+            if t <= time:
+                return heading + rate * (time - t)
+        return self._commands[0][2] if self._commands else 0.0
+
+    def _shift(self, obj: Object, shift: numpy.ndarray) -> Object:
+        box = numpy.array(obj.bbox[:4]) + shift
+        if box[2] <= box[0] or box[3] <= box[1]:
+            return obj
+        xmin, ymin, xmax, ymax = numpy.clip(box, 0.0, 1.0).tolist()
+        return obj._replace(bbox=obj.bbox._replace(xmin=xmin, ymin=ymin, xmax=xmax, ymax=ymax))
+
+    def _track_velocities(self, mot_tracker) -> dict:
+        """Returns {track id: box velocity per second in the view} from the SORT Kalman states."""
+        velocities = {}
+        if not self.frame_dt:
+            return velocities
+        for trk in getattr(mot_tracker, 'trackers', ()):
+            # SORT state: center u, v, area s, aspect ratio r, and per-update du, dv, ds
+            u, v, s, r, du, dv, ds = numpy.asarray(trk.kf.x, dtype=numpy.float64).ravel()[:7]
+            if s <= 0 or r <= 0:
+                continue
+            dw = ds * numpy.sqrt(r / s) / 2      # d(sqrt(s * r)) for a change ds of s
+            dh = dw / r
+            velocities[trk.id + 1] = numpy.array([du - dw / 2, dv - dh / 2, du + dw / 2, dv + dh / 2]) / self.frame_dt
+        return velocities
+
+    def predict(self, objs: list[Object], captured: float, now: float, trdata=(), mot_tracker=None) -> list[Object]:
+        """Returns objs with their boxes extrapolated to actuation time.
+        Args:
+            objs (list[Object]): The detections of the frame.
+            captured (float): The time.monotonic() the frame was captured at.
+            now (float): The current time.monotonic().
+            trdata (array, optional): The SORT output rows [xmin, ymin, xmax, ymax, track id] of the frame.
+            mot_tracker (Sort, optional): The tracker that produced trdata.
+        Returns:
+            list[Object]: The predicted detections.
+        """
+        actuation = now + self.actuation_delay
+        self.horizon = min(self.max_horizon, max(0.0, actuation - captured))
+        if self._last_update is not None and captured > self._last_update:
+            dt = captured - self._last_update
+            self.frame_dt = dt if self.frame_dt is None else 0.8 * self.frame_dt + 0.2 * dt
+        self._last_update = captured
+        if not objs:
+            return objs
+
+        # Objects move left in the view as the droid turns right
+        heading_captured = self.heading(captured)
+        ego = numpy.array([1.0, 0.0, 1.0, 0.0])
+        ego_shift = -(self.heading(captured + self.horizon) - heading_captured) * ego
+        ego_rate = self._rate(captured) * ego
+
+        tracks = numpy.asarray(trdata, dtype=numpy.float64).reshape(-1, 5) if len(trdata) else None
+        if tracks is not None and mot_tracker is not None:
+            velocities = self._track_velocities(mot_tracker)
+            predicted = []
+            for obj in objs:
+                ious = _iou(numpy.array(obj.bbox[:4]), tracks[:, :4])
+                best = int(numpy.argmax(ious))
+                velocity = velocities.get(int(tracks[best, 4])) if ious[best] >= self.match_iou else None
+                if velocity is None:
+                    predicted.append(self._shift(obj, ego_shift))
+                else:
+                    # View velocity plus the turning it included is the target's own motion
+                    predicted.append(self._shift(obj, (velocity + ego_rate) * self.horizon + ego_shift))
+            return predicted
+
+        # No tracker: filter the closest human only, the one the follow logic steers by
+        human = detect.get_closest_obj([obj for obj in objs if obj.id == 0])
+        stabilised = None if human is None else numpy.array(human.bbox[:4]) + heading_captured * ego
+        velocity = numpy.zeros(4) if human is None else self.filter.update(stabilised, captured)
+        return [self._shift(obj, velocity * self.horizon + ego_shift) if obj is human else self._shift(obj, ego_shift)
+                for obj in objs]
+
+def simulate(predict: bool, latency: float = 0.1, fps: float = 15, seconds: float = 30,
+             turn_rate: float = 0.6, amplitude: float = 0.35, period: float = 6.0) -> dict:
+    """Replays a human walking side to side in front of the droid through the follow logic.
+
+    The droid turns towards the human with left/right commands at turn_rate (fraction of the
+    camera view per second); frames are latency seconds old when the decision is made.
+    Returns:
+        dict: Mean absolute centering error, direction reversals and commands sent.
+    """
+    import math
+    predictor = BoxPredictor(actuation_delay=0.0, max_horizon=1.0,
+                             turn_rates={'A': -turn_rate, 'D': turn_rate})
+    heading, t, dt = 0.0, 0.0, 1.0 / fps
+    history = []    # (t, target x in view), to look up delayed frames
+    error, reversals, last_turn, commands = 0.0, 0, 0, 0
+    while t < seconds:
+        bearing = amplitude * math.sin(2 * math.pi * t / period)
+        history.append((t, 0.5 + bearing - heading))
+        captured, xcenter = next((h for h in reversed(history) if h[0] <= t - latency), history[0])
+        human = Object(id=0, score=0.9, bbox=detect.BBox(xcenter - 0.1, 0.2, xcenter + 0.1, 0.9, 0.14))
+        if predict:
+            human = predictor.predict([human], captured, t)[0]
+        # Same decision as AutoMovements._follow_human
+        if human.bbox.xmax < 0.5:
+            turn = -1
+        elif human.bbox.xmin > 0.5:
+            turn = 1
+        else:
+            turn = 0
+        if turn and last_turn and turn != last_turn:
+            reversals += 1
+        if turn:
+            last_turn = turn
+        commands += 1
+        predictor.record_command({-1: 'A', 0: 'W', 1: 'D'}[turn], t)
+        heading += turn * turn_rate * dt
+        error += abs(0.5 + bearing - heading - 0.5)
+        t += dt
+    return {'mean_error': error * dt / seconds, 'reversals': reversals, 'commands': commands}
+
+if __name__ == '__main__':
+    # Compare the follow logic with and without latency compensation
+    for latency in (0.05, 0.1, 0.2, 0.3):
+        for predict in (False, True):
+            result = simulate(predict, latency)
+            print(f"Latency {latency * 1000:.0f} ms, prediction {'on ' if predict else 'off'}: "
+                  f"mean error {result['mean_error']:.3f}, reversals {result['reversals']}")
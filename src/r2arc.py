@@ -3,9 +3,8 @@ r2arc.py
 Main program for the R2ARC project
 '''
 
-import vision, motors, ble
-import enum, threading
-from gstreamer import cameras
+import vision, motors, channel, governor, autotune
+import argparse, enum, threading, time
 
 class Controls:
     FORWARD = 'W'
@@ -17,6 +16,7 @@ class Controls:
     STOP = 'Q'
     FOLLOW = 'F'
     REMOTE = 'R'
+    RECORD = 'C'
     MOVEMENTS: set = {
         FORWARD, 
         LEFT, 
@@ -31,7 +31,10 @@ class Controls:
         FOLLOW, 
         REMOTE
     }
-    ALL: set = STATES.union(MOVEMENTS)
+    ACTIONS: set = {
+        RECORD
+    }
+    ALL: set = STATES.union(MOVEMENTS, ACTIONS)
     prints: dict = {
         FORWARD: "Moving forward", 
         LEFT: "Moving left", 
@@ -41,7 +44,8 @@ class Controls:
         PIVOT_RIGHT: "Pivoting right", 
         STOP: "Stopping", 
         FOLLOW: "Following", 
-        REMOTE: "Remote control"
+        REMOTE: "Remote control",
+        RECORD: "Recording clip"
     }
 
     def print_valid_command(command: str) -> str:
@@ -54,47 +58,99 @@ class State(enum.Enum):
     FOLLOW = 1
     REMOTE = 2
 
+def handle_command(command: str, state: State, r2vision: vision.DroidVision, r2motor: motors.Movements) -> State:
+    """Applies one operator command and returns the new state."""
+    if command == Controls.STOP:
+        state = State.IDLE
+        r2vision.set_follow(False)
+        r2motor.stop()
+        r2vision.trigger_recording('safety stop')
+    elif command == Controls.RECORD:
+        r2vision.trigger_recording('operator command')
+    elif command == Controls.FOLLOW:
+        state = State.FOLLOW if state != State.FOLLOW else State.IDLE
+        r2vision.toggle_follow()
+    elif command == Controls.REMOTE or command in Controls.MOVEMENTS:
+        state = State.REMOTE
+        r2vision.set_follow(False)
+        r2motor.send_command(command)
+    else:
+        print("Invalid command")
+    return state
+
+def telemetry_frame(state: State, r2vision: vision.DroidVision, r2motor: motors.Movements) -> channel.TelemetryFrame:
+    """Collects the current state and performance figures for the operator app."""
+    side, rank = r2vision.target_status()
+    return channel.TelemetryFrame(
+        state=state.value,
+        fps=r2vision.fps,
+        inference_ms=r2vision.inference_ms,
+        target_side=channel.NO_TARGET if side is None else int(side),
+        distance_rank=channel.NO_RANK if rank is None else rank,
+        last_command=r2motor.last_command)
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='R2-ARC main program')
+    parser.add_argument('--channel', choices=['ble', 'udp', 'unix'], default='ble', help='Command transport')
+    parser.add_argument('--port', type=int, default=5005, help='UDP port of the udp channel')
+    parser.add_argument('--socket', default='/tmp/r2arc.sock', help='Socket path of the unix channel')
+    parser.add_argument('--telemetry-rate', type=float, default=5.0, help='Maximum telemetry frames per second')
+    parser.add_argument('--governor', action=argparse.BooleanOptionalAction, default=True,
+                        help='Turn vision performance down as the droid heats up')
+    parser.add_argument('--profile', default=autotune.PROFILE_PATH, help='Autotune profile to load settings from')
+    parser.add_argument('--predict-latency', action='store_true', help='Steer by boxes extrapolated to actuation time')
+    parser.add_argument('--obstacle-memory', action='store_true', help='Avoid obstacles remembered across frames')
+    parser.add_argument('--framed-motors', action='store_true',
+                        help='Send framed motor commands with speed and turn rate, falling back to single bytes')
+    parser.add_argument('--control-rate', type=float, help='Run the follow logic at this fixed rate in Hz, e.g. 50')
+    args = parser.parse_args()
+
     # Setup motor controller communication
-    r2motor = motors.Movements()
+    r2motor = motors.Movements(framed=args.framed_motors)
     # Setup Machine Vision
-    r2vision = vision.DroidVision(resolution=cameras.get_razer_kiyo_resolution(), motor=r2motor)
+    r2vision = vision.DroidVision(motor=r2motor,
+                                  display=False, record_dir='../recordings', predict_latency=args.predict_latency,
+                                  profile=args.profile, obstacle_memory=args.obstacle_memory,
+                                  control_rate=args.control_rate)
     r2vision_thread = threading.Thread(target=r2vision.start)
     r2vision_thread.start()
-    # Setup Bluetooth Low Energy connection
-    SERVICE_UUID = '12345678-1234-1234-1234-123456789012'
-    CHARACTERISTIC_UUID = '87654321-4321-4321-4321-210987654321'
-    r2ble = ble.R2ARCService(SERVICE_UUID, CHARACTERISTIC_UUID)
-    r2ble.setup()
-    # Keep track of states and last command
+    # Degrade vision performance in steps before the CPU and the Edge TPU throttle
+    r2governor = governor.PerformanceGovernor(r2vision)
+    if args.governor:
+        r2governor.start()
+    # Setup the command channel: Bluetooth Low Energy, or a local socket for testing
+    if args.channel == 'ble':
+        SERVICE_UUID = '12345678-1234-1234-1234-123456789012'
+        CHARACTERISTIC_UUID = '87654321-4321-4321-4321-210987654321'
+        TELEMETRY_UUID = '87654321-4321-4321-4321-210987654322'
+        r2channel = channel.BLECommandChannel(SERVICE_UUID, CHARACTERISTIC_UUID, TELEMETRY_UUID)
+    elif args.channel == 'udp':
+        r2channel = channel.SocketCommandChannel(('0.0.0.0', args.port))
+    else:
+        r2channel = channel.SocketCommandChannel(args.socket)
+    r2channel.setup()
+    # Keep track of states and receive-to-actuate latency
     state = State.IDLE
-    command = ''
+    latency = channel.LatencyStats()
+    # Stream state and performance back to the operator
+    r2telemetry = channel.TelemetryPublisher(r2channel, lambda: telemetry_frame(state, r2vision, r2motor),
+                                             rate_hz=args.telemetry_rate)
+    r2telemetry.start()
 
     try:
         while True:
-            command = r2ble.update_user_input()
-
-            # Update state
-            if command == Controls.STOP:
-                state = State.IDLE
-                r2vision.set_follow(False)
-                r2motor.stop()
-            elif command == Controls.FOLLOW:
-                state = State.FOLLOW if state != State.FOLLOW else State.IDLE
-                r2vision.toggle_follow()
-            elif command == Controls.REMOTE or command in Controls.MOVEMENTS:
-                state = State.REMOTE
-                r2vision.set_follow(False)
-                r2motor.send_command(command)
-            else:
-                print("Invalid command")
+            packet = r2channel.receive()
 
-            print(f"Command function: {Controls.print_valid_command(command)}, State: {state} \n")
+            for command in packet.commands:
+                state = handle_command(command, state, r2vision, r2motor)
+                latency.record(time.monotonic() - packet.received)
+                print(f"Command function: {Controls.print_valid_command(command)}, State: {state}, Latency: {latency} \n")
 
     except KeyboardInterrupt:
         print("Quitting program")
         r2motor.stop()
-        r2ble.stop()
+        r2telemetry.stop()
+        r2governor.stop()
+        r2channel.stop()
         r2vision.stop(process="r2arc.py")
         r2vision_thread.join()
-        
\ No newline at end of file
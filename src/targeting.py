@@ -0,0 +1,143 @@
+'''
+targeting.py
+Target lock for the R2-ARC follow logic: keeps following the same human across frames instead of
+whichever human ranks closest in each frame.
+'''
+
+import time
+import numpy
+from gstreamer import detect
+from gstreamer import Object as Object
+
+class TargetLock:
+    """Locks onto one human and follows it by tracker ID.
+
+    While locked, the target is the detection with the locked track ID. When that track
+    disappears (the tracker lost it, or there is no tracker), the target is re-acquired within
+    grace seconds by overlap with its last box, by appearance if the detections carry
+    second-stage embeddings (cascade.CropCascade), or failing that by the nearest box of similar
+    size. Only without a lock, or after the grace window ran out, is the closest human ranked
+    with get_closest_obj and locked.
+    """
+    def __init__(self, grace: float = 1.0, reacquire_iou: float = 0.2, max_shift: float = 0.15,
+                 min_similarity: float = 0.8, clock=time.monotonic):
+        """
+        Args:
+            grace (float, optional): Seconds a lost target may be re-acquired for. Defaults to 1.0.
+            reacquire_iou (float, optional): Minimum IoU with the last box to re-acquire. Defaults to 0.2.
+            max_shift (float, optional): Furthest box center move, in view widths, to re-acquire by size. Defaults to 0.15.
+            min_similarity (float, optional): Minimum cosine similarity of embeddings to re-acquire, None to ignore features. Defaults to 0.8.
+            clock (callable, optional): The time source. Defaults to time.monotonic.
+        """
+        self.grace = grace
+        self.reacquire_iou = reacquire_iou
+        self.max_shift = max_shift
+        self.min_similarity = min_similarity
+        self._clock = clock
+        self.track_id = None
+        self.box = None     # [xmin, ymin, xmax, ymax] of the target when last seen
+        self.features = None    # Embedding of the target when last embedded
+        self.last_seen = None
+        self.acquisitions = 0
+
+    @property
+    def locked(self) -> bool:
+        return self.box is not None
+
+    def release(self) -> None:
+        self.track_id, self.box, self.features, self.last_seen = None, None, None, None
+
+    def _lock(self, target: Object, now: float) -> None:
+        self.track_id = target.track_id
+        self.box = numpy.array(target.bbox[:4], dtype=numpy.float32)
+        if target.features is not None:
+            self.features = target.features
+        self.last_seen = now
+
+    def _reacquire(self, humans: list[Object]) -> Object:
+        """Returns the human that most likely is the lost target, or None."""
+        boxes = numpy.array([human.bbox[:4] for human in humans], dtype=numpy.float32)
+        ious = detect.box_iou(self.box[numpy.newaxis], boxes)[0]
+        best = int(ious.argmax())
+        if ious[best] >= self.reacquire_iou:
+            return humans[best]
+        embedded = [human for human in humans if human.features is not None]
+        if self.min_similarity is not None and self.features is not None and embedded:
+            similarity = numpy.array([human.features for human in embedded]) @ self.features
+            best = int(similarity.argmax())
+            if similarity[best] >= self.min_similarity:
+                return embedded[best]
+        # No overlap: accept a box of similar size whose center moved a little
+        centers = (boxes[:, :2] + boxes[:, 2:]) / 2
+        shift = numpy.hypot(*(centers - (self.box[:2] + self.box[2:]) / 2).T)
+        areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+        ratio = areas / max(float((self.box[2] - self.box[0]) * (self.box[3] - self.box[1])), 1e-9)
+        shift[(shift > self.max_shift) | (ratio < 0.5) | (ratio > 2.0)] = numpy.inf
+        best = int(shift.argmin())
+        return humans[best] if numpy.isfinite(shift[best]) else None
+
+    def select(self, humans: list[Object]) -> Object:
+        """Returns the target among the humans of a frame, or None if it is not visible.
+        Args:
+            humans (list[Object]): The humans detected in the camera view.
+        Returns:
+            Object: The locked target, or the newly locked closest human.
+        """
+        now = self._clock()
+        if self.locked:
+            target = None
+            if self.track_id is not None:
+                target = next((human for human in humans if human.track_id == self.track_id), None)
+            if target is None and humans:
+                target = self._reacquire(humans)
+            if target is not None:
+                self._lock(target, now)
+                return target
+            if now - self.last_seen <= self.grace:
+                return None
+            self.release()
+        target = detect.get_closest_obj(objs=humans)
+        if target is not None:
+            self._lock(target, now)
+            self.acquisitions += 1
+        return target
+
+def _steer(human: Object) -> str:
+    """The command AutoMovements._follow_human sends for a human."""
+    if human is None:
+        return None
+    if human.bbox.xmin < 0.5 < human.bbox.xmax:
+        return 'W'
+    return 'A' if human.bbox.xmax < 0.5 else 'D'
+
+if __name__ == '__main__':
+    # Two people at almost the same distance on either side of the view, so the closest one
+    # alternates with detection noise; the left one's track is lost and renumbered midway.
+    rng = numpy.random.default_rng(0)
+    frames = []
+    for i in range(300):
+        people = []
+        for track_id, xcenter in ((1, 0.3), (2, 0.7)):
+            if track_id == 1 and 140 <= i < 150:
+                continue    # Occluded
+            ymax, height, width = 0.85 + rng.normal(0, 0.02), 0.6 + rng.normal(0, 0.02), 0.2 + rng.normal(0, 0.01)
+            box = detect.BBox(xcenter - width / 2, ymax - height, xcenter + width / 2, ymax, width * height)
+            people.append(Object(0, 0.8 + rng.normal(0, 0.05), box, 3 if track_id == 1 and i >= 150 else track_id))
+        frames.append(people)
+
+    t = [0.0]
+    lock = TargetLock(clock=lambda: t[0])
+    for name, select in (('ranking', lambda humans: detect.get_closest_obj(objs=humans)), ('lock', lock.select)):
+        switches, changes, last_target, last_command = 0, 0, None, None
+        for i, humans in enumerate(frames):
+            t[0] = i / 30
+            target = select(humans)
+            side = None if target is None else target.bbox.xmin > 0.5
+            if target is not None and last_target is not None and side != last_target:
+                switches += 1
+            command = _steer(target)
+            if command and command != last_command:
+                changes += 1
+            last_target = side if target is not None else last_target
+            last_command = command or last_command
+        print(f"{name:<8} target switches {switches:>3}, motor command changes {changes:>3}")
@@ -4,7 +4,7 @@ R2-ARC Machine Vision module using gstreamer, Google Coral TPU, and TensorFlow L
 """
 
 import time, numpy, os
-import motors
+import control, motors, occupancy, prediction, targeting
 from gstreamer import *
 from gstreamer import Object as Object
 
@@ -12,10 +12,22 @@ class PositionSide:
     LEFT = False
     RIGHT = True
 
+class CameraPosition:
+    FRONT = 0
+    REAR = 1
+
 class AutoMovements:
-    def __init__(self, motor: motors.Movements):
+    def __init__(self, motor: motors.Movements, lock_grace: float = 1.0,
+                 obstacles: occupancy.OccupancyGrid = None):
         self.last_human_position = PositionSide.LEFT    # Default
+        self.last_human_camera = CameraPosition.FRONT
+        self.front_has_human = False
+        self.target = None  # Locked human in the last front camera frame, while following
+        self.lock = targeting.TargetLock(lock_grace)
+        # Obstacle memory across frames, fed by DroidVision; None to react to single frames
+        self.obstacles = obstacles
         self._motors = motor
+        self._steer = {'W': motor.forward, 'A': motor.left, 'D': motor.right}
 
     def _get_obj_xside(self, obj: Object) -> PositionSide:
         """Returns the position side of the object in the camera view.
@@ -36,11 +48,48 @@ class AutoMovements:
             # print("Last seen human position was right, pivoting right")
             self._motors.pivot_right()
 
+    def _avoid_obstacles(self, human) -> bool:
+        """Steers around remembered obstacles on the path towards the given human.
+        Args:
+            human (BBox Object): The human detected in the camera view.
+        Returns:
+            bool: True if the path was blocked and an avoiding command was sent, False otherwise.
+        """
+        if human.bbox.xmin < 0.5 < human.bbox.xmax:
+            wanted = 'W'
+        else:
+            wanted = 'A' if human.bbox.xmax < 0.5 else 'D'
+        if not self.obstacles.blocked(wanted):
+            return False
+        free = [command for command in ('A', 'D', 'W') if command != wanted and not self.obstacles.blocked(command)]
+        if free:
+            self._steer[free[0]]()
+        else:
+            self._face_last_human_position()
+        return True
+
+    def _drive_towards(self, human) -> None:
+        """Steers at the given human in proportion to its offset from the center of the view, and
+        slows down as it gets closer; for motors that take a speed and turn rate.
+        Args:
+            human (BBox Object): The human detected in the camera view.
+        """
+        offset = (human.bbox.xmin + human.bbox.xmax) / 2 - 0.5    # -0.5 (left edge) .. 0.5
+        distance = float(detect.get_distances([human])[0])
+        # Full speed from 2 m further than the stopping distance, turning slows it down
+        speed = (30 + 70 * min(1.0, max(0.0, (distance - 0.8) / 2.0))) * (1 - abs(offset))
+        self._motors.drive(speed, -200 * offset)
+
     def _follow_human(self, human) -> None:
         """Follows the given human in the camera view.
         Args:
             human (BBox Object): The human detected in the camera view.
         """
+        if self.obstacles and self._avoid_obstacles(human):
+            return
+        if getattr(self._motors, 'framed', False):
+            self._drive_towards(human)
+            return
         # if human is centered in camera view
         if human.bbox.xmin < 0.5 and 0.5 < human.bbox.xmax:
             # print("Human is centered, moving forward")
@@ -54,18 +103,42 @@ class AutoMovements:
             # print("Human is to the right of the center, moving right")
             self._motors.right()
 
-    def find_human(self, objs: list[Object]) -> bool:
-        """Finds the closest human and object in the camera view. Then moves towards the human.
+    def _find_human_behind(self, objs: list[Object]) -> bool:
+        """Pivots towards a human seen by the rear camera while the front camera sees none.
+        Args:
+            objs (list[Object]): The Bounding Box objects detected in the rear camera view.
+        Returns:
+            bool: Always False; a human behind the droid is never reached.
+        """
+        closest_human = detect.get_closest_obj(objs=[obj for obj in objs if obj.id == 0])
+        # The front camera has priority; the rear camera only helps when it lost the human
+        if not closest_human or self.front_has_human:
+            return False
+        # The rear camera is mirrored: its left side is the droid's right side
+        self.last_human_position = not self._get_obj_xside(closest_human)
+        self.last_human_camera = CameraPosition.REAR
+        self._face_last_human_position()
+        return False
+
+    def find_human(self, objs: list[Object], camera: CameraPosition = CameraPosition.FRONT) -> bool:
+        """Finds the locked human, or locks the closest one, and the closest object in the camera view.
+        Then moves towards the human.
         Args:
             objs (list[Object]): The Bounding Box objects detected in the camera view.
+            camera (CameraPosition, optional): The camera the objects were detected by. Defaults to FRONT.
         Returns:
             bool: True if human is found/reached, False otherwise.
         """
+        if camera == CameraPosition.REAR:
+            return self._find_human_behind(objs)
+
         reached: bool = False
-        closest_human = detect.get_closest_obj(objs=[obj for obj in objs if obj.id == 0])
+        closest_human = self.lock.select([obj for obj in objs if obj.id == 0])
         closest_obj = detect.get_closest_obj(objs=objs, min_certainty=None)
+        self.front_has_human = closest_human is not None
+        self.target = closest_human
 
-        # If no human is detected
+        # If no human is detected, or the locked human is out of view
         if not closest_human:
             # print("No humans detected")
             # Pivot in directions of last seen human position
@@ -97,11 +170,12 @@ class AutoMovements:
         # print()
         # Cache last seen human position
         self.last_human_position = self._get_obj_xside(closest_human)
+        self.last_human_camera = CameraPosition.FRONT
         return reached
 
 class DroidVision:
     def __init__(self, 
-                 motor: motors.Movements = motors.Movements(), 
+                 motor: motors.Movements = None, 
                  model: str = "../models/mobilenet_ssd_v2_coco_quant_postprocess_edgetpu.tflite", 
                  labels: str = "../models/coco_labels.txt", 
                  top_k = numpy.uint8(20), 
@@ -109,31 +183,138 @@ class DroidVision:
                  threshold = numpy.float16(0.2), 
                  videosrc: str = '/dev/video0', 
                  videofmt: str = 'raw', 
-                 resolution: tuple = cameras.get_resolution()):
+                 resolution: tuple = None,
+                 camera_positions: tuple = (CameraPosition.FRONT, CameraPosition.REAR),
+                 latency_budget: float = None,
+                 display: bool = True,
+                 stream_port: int = None,
+                 stream_codec: str = 'mjpeg',
+                 stream_fps: int = 15,
+                 stream_bitrate: int = 2000,
+                 record_dir: str = None,
+                 pre_roll: float = 10.0,
+                 post_roll: float = 5.0,
+                 motion_gate: bool = True,
+                 src_format: str = None,
+                 predict_latency: bool = False,
+                 actuation_delay: float = 0.05,
+                 cascade_model: str = None,
+                 cascade_cpu: bool = False,
+                 crop_budget: int = 4,
+                 cascade_output: str = 'embedding',
+                 queue_depth: int = 1,
+                 threads: int = None,
+                 profile: str = None,
+                 obstacle_memory: bool = False,
+                 class_ids: tuple = detect.FOLLOW_CLASSES,
+                 nms_iou: float = 0.7,
+                 control_rate: float = None):
         """"Main function to run object detection on camera frames using GStreamer.
         Args:
+            motor (Movements, optional): The motor controller. Defaults to None (motors.Movements() on SPI channel 0).
             model (str, optional): The path to the model file. Defaults to "../models/mobilenet_ssd_v2_coco_quant_postprocess_edgetpu.tflite".
             labels (str, optional): The path to the labels file. Defaults to "../models/coco_labels.txt".
             top_k (int, optional): The number of top results to display. Defaults to 20.
             tracker ([type], optional): The object tracker to use. Defaults to None. Choices: [None, 'sort']
             threshold (float, optional): The threshold for detection. Defaults to 0.2.
-            videosrc (str, optional): The video source. Defaults to '/dev/video0'.
+            videosrc (str | list[str], optional): The video source, or one per camera. Defaults to '/dev/video0'.
             videofmt (str, optional): The video format. Defaults to 'raw'. Choices: ['raw', 'h264', 'jpeg']
-            resolution (tuple, optional): The resolution of the camera. Defaults to cameras.get_resolution().
+            resolution (tuple, optional): The resolution of the camera, or one per camera. Defaults to None (the mode of each source cheapest to turn into model input, see cameras.get_resolution).
+            camera_positions (tuple, optional): Where each video source is mounted, in videosrc order. Defaults to (FRONT, REAR).
+            latency_budget (float, optional): Frames waiting longer than this many seconds are dropped. Defaults to None.
+            display (bool, optional): Show the annotated feed in a local window. Defaults to True.
+            stream_port (int, optional): Serve the annotated feed over HTTP on this port. Defaults to None (disabled).
+            stream_codec (str, optional): The streaming and recording codec. Defaults to 'mjpeg'. Choices: ['mjpeg', 'h264']
+            stream_fps (int, optional): The streaming frame rate, independent of the inference rate. Defaults to 15.
+            stream_bitrate (int, optional): The H.264 streaming bitrate in kbit/s. Defaults to 2000.
+            record_dir (str, optional): Write event-triggered clips to this directory. Defaults to None (disabled).
+            pre_roll (float, optional): Seconds of video kept in memory before a recording trigger. Defaults to 10.
+            post_roll (float, optional): Seconds of video recorded after a recording trigger. Defaults to 5.
+            motion_gate (bool, optional): Skip inference on static frames while the droid is idle. Defaults to True.
+            src_format (str, optional): The raw pixel format to capture, e.g. 'YUY2'. Defaults to None (probed from the camera).
+            predict_latency (bool, optional): Steer by boxes extrapolated to actuation time. Defaults to False.
+            actuation_delay (float, optional): Seconds from a motor command to it taking effect, for predict_latency. Defaults to 0.05.
+            cascade_model (str, optional): A second-stage model run on the person crops of every frame. Defaults to None (disabled).
+            cascade_cpu (bool, optional): Run the second-stage model on the CPU instead of the Edge TPU. Defaults to False.
+            crop_budget (int, optional): The most crops per frame the second stage runs on. Defaults to 4.
+            cascade_output (str, optional): What the second-stage model outputs. Defaults to 'embedding'. Choices: ['embedding', 'scores']
+            queue_depth (int, optional): Frames held by the pipeline's leaky queues. Defaults to 1.
+            threads (int, optional): The most video conversion threads. Defaults to None (CPU count, at most 4).
+            profile (str, optional): An autotune profile file; its settings for this camera and board override the arguments above. Defaults to None.
+            obstacle_memory (bool, optional): Avoid obstacles remembered in an occupancy grid, not only those in the current frame. Defaults to False.
+            class_ids (tuple, optional): The classes kept from the detector output, None for all. Defaults to detect.FOLLOW_CLASSES.
+            nms_iou (float, optional): Drop boxes overlapping a higher scoring box of any class by more than this, None to keep them. Defaults to 0.7.
+            control_rate (float, optional): Run the follow logic in a fixed-rate loop at this many Hz on the latest detections, instead of on every frame. Defaults to None (on every frame).
         """
         self.model = model
         self.labels = labels
         self.top_k = top_k
         self.tracker = tracker
         self.threshold = threshold
+        self.class_ids = class_ids
+        self.nms_iou = nms_iou
         self.videosrc = videosrc
         self.videofmt = videofmt
         self.resolution = resolution
+        self.camera_positions = camera_positions
+        self.latency_budget = latency_budget
+        self.num_sources = 1 if isinstance(videosrc, str) else len(videosrc)
+        self.display = display
+        self.stream_codec = stream_codec
+        self.stream_fps = stream_fps
+        self.stream_bitrate = stream_bitrate
+        self.stream = streaming.StreamServer(stream_port, stream_codec) if stream_port else None
+        self.recorder = recorder.ClipRecorder(record_dir, stream_codec, pre_roll, post_roll) if record_dir else None
+        self.motion_gate = motion_gate
+        self.src_format = src_format
+        self.queue_depth = queue_depth
+        self.threads = threads
+        if profile:
+            self._load_profile(profile)
+        self.predictor = prediction.BoxPredictor(actuation_delay) if predict_latency else None
+        self.cascade = None
+        if cascade_model:
+            self.cascade = cascade.CropCascade(cascade.make_classifier(cascade_model, cascade_cpu), crop_budget,
+                                               output=cascade_output, positive_index=0 if cascade_output == 'scores' else None)
         self._init_model()
         self._init_display()
+        if self.resolution is None:
+            # Needs the model's input size, so probed once it is loaded
+            self.resolution = self._select_resolution()
         self.follow: bool = False
         self.follow_counter = numpy.uint8(0)
-        self.automove = AutoMovements(motor)
+        # Latest performance figures, read by telemetry
+        self.fps: float = 0.0
+        self.inference_ms: float = 0.0
+        self.frame_latency_ms: float = 0.0  # Capture to decision
+        # Performance knobs, turned down by governor.PerformanceGovernor when the droid runs hot
+        self.pipeline = None
+        self.capture_framerate: float = None
+        self.detect_interval: int = 1
+        self.overlay: bool = True
+        self.automove = AutoMovements(motor or motors.Movements(), obstacles=occupancy.OccupancyGrid() if obstacle_memory else None)
+        if cascade_output != 'embedding':
+            # Class scores say nothing about who a person is
+            self.automove.lock.min_similarity = None
+        # Latest detections per camera for the control loop, and the frame it last decided on
+        self.snapshots = [None] * self.num_sources
+        self._decided_frames = [0] * self.num_sources
+        self.control = control.ControlLoop(self._control_step, control_rate) if control_rate else None
+
+    def _load_profile(self, path: str):
+        import autotune     # Only needed with a profile
+        settings = autotune.load_profile(path, self.videosrc)
+        if not settings:
+            print(f"No autotune profile for {self.videosrc} in {path}, using defaults")
+            return
+        print(f"Loaded autotune profile: {settings}")
+        if 'resolution' in settings:
+            self.resolution = tuple(settings['resolution'])
+        self.top_k = numpy.uint8(settings.get('top_k', self.top_k))
+        self.threshold = numpy.float16(settings.get('threshold', self.threshold))
+        self.tracker = settings.get('tracker', self.tracker)
+        self.queue_depth = settings.get('queue_depth', self.queue_depth)
+        self.threads = settings.get('threads', self.threads)
 
     def _init_model(self):
         attempts = numpy.uint8(3)
@@ -151,8 +332,17 @@ class DroidVision:
     def _init_display(self):
         w, h, _ = common.input_image_size(self.interpreter)
         self.inference_size = (w, h)
-        # Average fps over last 30 frames.
-        self.fps_counter = common.avg_fps_counter(30)
+        # Boxes are normalized to the model input, so distances use its aspect ratio
+        detect.range_estimator = ranging.RangeEstimator.load(aspect=w / h)
+        # Average fps over last 30 frames, per camera.
+        self.fps_counters = [common.avg_fps_counter(30) for _ in range(self.num_sources)]
+        # Static scenes reuse the last detections of their camera.
+        shape = self.interpreter.get_input_details()[0]['shape'][1:]
+        self.motion_gates = [common.MotionGate(shape) for _ in range(self.num_sources)]
+        self.last_objs = [[] for _ in range(self.num_sources)]
+        self.frame_counts = [0] * self.num_sources
+        # Output arrays reused every frame, per camera.
+        self.output_buffers = [detect.OutputBuffers(self.interpreter, self.top_k, self.class_ids) for _ in range(self.num_sources)]
 
     def _auto_stop(self, reached_human: bool) -> bool:
         """Implement a counter to automatically stop following after a certain number of frames of detecting a human.
@@ -167,54 +357,212 @@ class DroidVision:
             self.follow_counter -= numpy.uint8(1)
         return self.follow_counter == numpy.iinfo(self.follow_counter.dtype).max
 
-    def _user_callback(self, input_tensor, src_size, inference_box, mot_tracker):
-        start_time = time.monotonic()
-        common.set_input(self.interpreter, input_tensor)
-        self.interpreter.invoke()
-        objs = detect.get_output(self.interpreter, self.threshold, self.top_k)
-        # print(f"Follow state: {self.follow}")
-        if self.follow:
-            reached_human = self.automove.find_human(objs)
+    def _idle(self) -> bool:
+        """Returns True if the motion gate may skip inference: not following and motors stopped."""
+        return self.motion_gate and not self.follow and self.automove._motors.is_stopped()
+
+    def _decide(self, camera: CameraPosition, objs: list[Object], captured: float, trdata=(), mot_tracker=None,
+                fresh: bool = True):
+        """Runs the follow logic on the detections of one camera frame and sends the motor command.
+        Args:
+            camera (CameraPosition): The camera the objects were detected by.
+            objs (list[Object]): The detections of the frame.
+            captured (float): The time.monotonic() the frame was captured at.
+            fresh (bool, optional): False if the frame was decided on before, so it is not added to the obstacle memory again and does not count towards auto stop. Defaults to True.
+        """
+        targets = objs
+        if self.predictor and camera == CameraPosition.FRONT:
+            # Decide on where the boxes will be when the command lands, not where they were
+            targets = self.predictor.predict(objs, captured, time.monotonic(), trdata, mot_tracker)
+        if self.automove.obstacles and camera == CameraPosition.FRONT and fresh:
+            # Each frame is added once, so remembered obstacles fade between frames; people
+            # move, so only other objects are remembered
+            self.automove.obstacles.update([obj for obj in targets if obj.id != 0], time.monotonic())
+        had_human = self.automove.front_has_human
+        reached_human = self.automove.find_human(targets, camera)
+        if self.predictor:
+            self.predictor.record_command(self.automove._motors.last_command, time.monotonic())
+        if self.automove.obstacles:
+            # Dead-reckon the obstacles with the command in effect from now on
+            self.automove.obstacles.command(self.automove._motors.last_command, time.monotonic())
+        if camera == CameraPosition.FRONT and fresh:
             self.follow = not self._auto_stop(reached_human)
-            # if not self.follow:
-                # print("Auto stopped triggered")
-        end_time = time.monotonic()
+            if had_human and not self.automove.front_has_human:
+                self.trigger_recording('target lost')
+            elif reached_human and self.follow_counter == numpy.uint8(1):
+                self.trigger_recording('too close')
+        # if not self.follow:
+            # print("Auto stopped triggered")
+
+    def _control_step(self, now: float):
+        """Decides on the latest snapshot of every camera; called by the control loop."""
+        if not self.follow:
+            return
+        for source, snapshot in enumerate(self.snapshots):
+            if snapshot is None:
+                continue
+            camera = self.camera_positions[source]
+            if now - snapshot.captured > control.MAX_SNAPSHOT_AGE:
+                # The pipeline stalled: don't keep steering by what the camera saw back then
+                if camera == CameraPosition.FRONT and not self.automove._motors.is_stopped():
+                    self.automove._motors.stop()
+                continue
+            fresh = snapshot.frame != self._decided_frames[source]
+            self._decided_frames[source] = snapshot.frame
+            self._decide(camera, snapshot.objs, snapshot.captured, snapshot.trdata, snapshot.mot_tracker, fresh)
+            if not self.follow:
+                break
+
+    def _user_callback(self, input_tensor, src_size, inference_box, mot_tracker, source=0, captured=None):
+        start_time = time.monotonic()
+        captured = start_time if captured is None else captured
+        # Rows [xmin, ymin, xmax, ymax, score] of this frame, filled in place by get_output
+        buffers = self.output_buffers[source]
+        self.frame_counts[source] += 1
+        if self.frame_counts[source] % self.detect_interval or (
+                self._idle() and not self.motion_gates[source].changed(input_tensor)):
+            objs = self.last_objs[source]
+        else:
+            common.set_input(self.interpreter, input_tensor)
+            self.interpreter.invoke()
+            objs = detect.get_output(self.interpreter, self.threshold, buffers.top_k, buffers=buffers,
+                                     nms_iou=self.nms_iou)
+            if self.cascade:
+                # Crop from the input tensor: the frame exactly as the detector saw it
+                objs = self.cascade.run(common.input_tensor(self.interpreter), objs)
+                if len(objs) < buffers.count:
+                    # Keep the rejected false positives out of the tracker too
+                    buffers.select(self.cascade.kept)
+            self.last_objs[source] = objs
+        camera = self.camera_positions[source]
+        if self.recorder:
+            self.recorder.add_detections(input_tensor.pts, objs, source)
         # print(f"Detected objects: {objs}")
-        detections = numpy.array([(o.bbox.xmin, o.bbox.ymin, o.bbox.xmax, o.bbox.ymax, o.score) for o in objs])
         trdata = []
         trackerFlag = False
-        if detections.any():
-            if mot_tracker != None:
-                trdata = mot_tracker.update(detections)
-                trackerFlag = True
-            text_lines = [
-                'Inference: {:.2f} ms'.format((end_time - start_time) * 1000),
-                'FPS: {} fps'.format(round(next(self.fps_counter))), ]
-        if len(objs) != 0:
+        if buffers.count and mot_tracker != None:
+            trdata = mot_tracker.update(buffers.detections[:buffers.count])
+            trackerFlag = True
+            objs = detect.assign_track_ids(objs, trdata)
+        # print(f"Follow state: {self.follow}")
+        if self.control:
+            # The control loop decides on the latest snapshot at its own rate
+            self.snapshots[source] = control.Snapshot(objs, captured, trdata, mot_tracker, self.frame_counts[source])
+        elif self.follow:
+            self._decide(camera, objs, captured, trdata, mot_tracker)
+        end_time = time.monotonic()
+        self.inference_ms = (end_time - start_time) * 1000
+        self.frame_latency_ms = (end_time - captured) * 1000
+        fps = next(self.fps_counters[source])
+        if source == 0:
+            self.fps = fps
+        text_lines = [
+            'Inference: {:.2f} ms'.format(self.inference_ms),
+            'FPS: {} fps'.format(round(fps)), ]
+        if len(objs) != 0 and self.overlay:
             return detect.generate_svg(src_size, self.inference_size, inference_box, objs, self.labels, text_lines, trdata, trackerFlag)
 
+    def _select_resolution(self):
+        """Returns the capture size of every video source that is cheapest to turn into model input."""
+        videosrcs = [self.videosrc] if isinstance(self.videosrc, str) else list(self.videosrc)
+        videofmts = [self.videofmt] * len(videosrcs) if isinstance(self.videofmt, str) else list(self.videofmt)
+        resolutions = [cameras.get_resolution(src, self.inference_size, videofmt=videofmt)
+                       for src, videofmt in zip(videosrcs, videofmts)]
+        print('Capture resolution: {}'.format(', '.join('{}x{}'.format(*size) for size in resolutions)))
+        return resolutions[0] if isinstance(self.videosrc, str) else resolutions
+
+    def _src_formats(self) -> list:
+        """Returns the raw pixel format of every video source, probing cameras that have none set."""
+        videosrcs = [self.videosrc] if isinstance(self.videosrc, str) else list(self.videosrc)
+        resolutions = [self.resolution] * len(videosrcs) if isinstance(self.resolution[0], int) else list(self.resolution)
+        if self.src_format or not isinstance(self.videofmt, str):
+            return [self.src_format] * len(videosrcs)
+        return [cameras.get_format(src, size, self.videofmt) if src.startswith('/dev/video') else None
+                for src, size in zip(videosrcs, resolutions)]
+
     def start(self):
-        self.run = gstreamer.run_pipeline(
+        encoded_sinks = []
+        if self.stream:
+            self.stream.start()
+            encoded_sinks.append(self.stream)
+        if self.recorder:
+            encoded_sinks.append(self.recorder)
+        self.pipeline = gstreamer.make_pipeline(
             self._user_callback,
             self.resolution,
             self.inference_size,
             self.tracker,
             self.videosrc,
-            self.videofmt
+            self.videofmt,
+            self.latency_budget,
+            self.display,
+            encoded_sinks,
+            self.stream_codec,
+            self.stream_fps,
+            self.stream_bitrate,
+            self._src_formats(),
+            queue_depth=self.queue_depth,
+            threads=self.threads
         )
+        self.pipeline.set_framerate(self.capture_framerate)
+        self.pipeline.set_overlay(self.overlay)
+        if self.control:
+            self.control.start()
+        self.pipeline.run()
+        if self.control:
+            self.control.stop()
 
     def stop(self, process: str = "vision.py"):
         self.follow = False
-        self.run = None
+        self.pipeline = None
+        if self.control:
+            self.control.stop()
+        if self.stream:
+            self.stream.stop()
         os.system(f"pkill -f {process}")
 
+    def set_capture_framerate(self, framerate: float):
+        """Caps the frame rate fed to inference; None for the camera's full rate."""
+        self.capture_framerate = framerate
+        if self.pipeline:
+            self.pipeline.set_framerate(framerate)
+
+    def set_overlay(self, overlay: bool):
+        """Turns drawing detections on the displayed and streamed video on or off."""
+        self.overlay = overlay
+        if self.pipeline:
+            self.pipeline.set_overlay(overlay)
+
+    def set_top_k(self, top_k: int):
+        """Changes the number of detections read from the model per frame."""
+        self.top_k = numpy.uint8(top_k)
+        # The callback takes its buffers once per frame, so swapping them is safe mid-frame
+        self.output_buffers = [detect.OutputBuffers(self.interpreter, self.top_k, self.class_ids) for _ in range(self.num_sources)]
+
+    def trigger_recording(self, reason: str):
+        """Saves the pre-roll and post-roll around this moment to a clip, if recording is enabled.
+        Args:
+            reason (str): The event that triggered the recording, used in the clip name.
+        """
+        if self.recorder:
+            self.recorder.trigger(reason)
+
+    def target_status(self) -> tuple:
+        """Returns the side and distance rank of the followed human, or (None, None) if there is none."""
+        target = self.automove.target if self.follow else None
+        if target is None:
+            return None, None
+        return self.automove._get_obj_xside(target), int(detect.get_proximity(target.bbox.ymax))
+
     def set_follow(self, follow: bool):
         self.follow = follow
         self.follow_counter = numpy.uint8(0)
+        self.automove.lock.release()
 
     def toggle_follow(self):
         self.follow ^= True
         self.follow_counter = numpy.uint8(0)
+        self.automove.lock.release()
         if not self.follow:
             self.automove._motors.stop()
 